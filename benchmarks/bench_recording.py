@@ -0,0 +1,127 @@
+"""Metric recording throughput of MetricRecorder and the opencensus recorder
+
+Every thread records a count and a distribution measurement in a loop while
+metrics are collected periodically, as the stats exporter would.
+
+Usage::
+
+    python benchmarks/bench_recording.py [--records N] [--threads N ...]
+"""
+
+import argparse
+import threading
+import time
+
+from opencensus.stats import aggregation, measure, view
+from opencensus.stats import stats as stats_module
+from opencensus.tags import tag_key, tag_map, tag_value
+
+from opencensus_ext_newrelic.recording import MetricRecorder
+
+LATENCY = measure.MeasureFloat("bench_latency", "Latency", "ms")
+REQUESTS = measure.MeasureInt("bench_requests", "Requests", "1")
+VIEWS = [
+    view.View(
+        "bench_requests",
+        "Requests",
+        ("method",),
+        REQUESTS,
+        aggregation.CountAggregation(),
+    ),
+    view.View(
+        "bench_latency",
+        "Latency",
+        ("method",),
+        LATENCY,
+        aggregation.DistributionAggregation([1.0, 5.0, 10.0, 50.0, 100.0]),
+    ),
+]
+
+
+def opencensus_worker(records):
+    stats = stats_module.stats
+    tags = tag_map.TagMap()
+    tags.insert(tag_key.TagKey("method"), tag_value.TagValue("GET"))
+
+    def work():
+        recorder = stats.stats_recorder
+        for i in range(records):
+            mmap = recorder.new_measurement_map()
+            mmap.measure_int_put(REQUESTS, 1)
+            mmap.measure_float_put(LATENCY, i % 120)
+            mmap.record(tags)
+
+    return work, stats.get_metrics
+
+
+def metric_recorder_worker(records):
+    recorder = MetricRecorder(VIEWS)
+
+    def work():
+        record = recorder.record
+        tags = ("GET",)
+        for i in range(records):
+            record("bench_requests", 1, tags)
+            record("bench_latency", i % 120, tags)
+
+    return work, recorder.get_metrics
+
+
+def run(worker, threads, records, collect_interval=0.05):
+    work, get_metrics = worker(records)
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+
+    done = threading.Event()
+    errors = [0]
+
+    def collect():
+        while not done.wait(collect_interval):
+            # The opencensus recorder may be read while a distribution is
+            # partially updated, which fails the distribution's validation
+            try:
+                list(get_metrics())
+            except ValueError:
+                errors[0] += 1
+
+    collector = threading.Thread(target=collect)
+    collector.start()
+
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+
+    done.set()
+    collector.join()
+    return elapsed, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    view_manager = stats_module.stats.view_manager
+    for view_ in VIEWS:
+        view_manager.register_view(view_)
+
+    print("threads  recorder        seconds  records/s  collect errors")
+    for threads in args.threads:
+        for name, worker in (
+            ("opencensus", opencensus_worker),
+            ("MetricRecorder", metric_recorder_worker),
+        ):
+            elapsed, errors = run(worker, threads, args.records)
+            throughput = threads * args.records / elapsed
+            print(
+                "{:>7}  {:<14}  {:>7.2f}  {:>9.0f}  {:>14}".format(
+                    threads, name, elapsed, throughput, errors
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
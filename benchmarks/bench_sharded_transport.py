@@ -0,0 +1,96 @@
+"""Span export throughput of ShardedTransport against a local stub server
+
+Usage::
+
+    python benchmarks/bench_sharded_transport.py [--spans N] [--latency S]
+"""
+
+import argparse
+import functools
+import time
+from datetime import datetime, timedelta
+
+from newrelic_telemetry_sdk import SpanClient
+from opencensus.trace import span_context
+from opencensus.trace.span_data import SpanData
+
+from opencensus_ext_newrelic import NewRelicTraceExporter
+from opencensus_ext_newrelic._stub import StubServer
+from opencensus_ext_newrelic.trace import ShardedTransport
+
+
+def make_spans(count, spans_per_trace=10):
+    start = datetime.utcnow()
+    start_time = start.isoformat() + "Z"
+    end_time = (start + timedelta(milliseconds=5)).isoformat() + "Z"
+    fields = dict.fromkeys(SpanData._fields)
+
+    spans = []
+    for i in range(count):
+        trace_id = "{:032x}".format(i // spans_per_trace + 1)
+        span_id = "{:016x}".format(i + 1)
+        fields.update(
+            name="span-{}".format(i % 50),
+            context=span_context.SpanContext(trace_id=trace_id, span_id=span_id),
+            span_id=span_id,
+            parent_span_id="{:016x}".format(i),
+            attributes={"http.method": "GET", "http.status_code": 200},
+            start_time=start_time,
+            end_time=end_time,
+            span_kind=0,
+        )
+        spans.append(SpanData(**fields))
+    return spans
+
+
+def run(shards, spans, latency):
+    with StubServer(latency=latency) as server:
+        exporter = NewRelicTraceExporter(
+            "stub-insert-key",
+            service_name="Benchmark",
+            transport=functools.partial(
+                ShardedTransport,
+                shards=shards,
+                wait_period=0.01,
+                max_queue_size=len(spans),
+            ),
+        )
+        exporter.client = client = server.client(SpanClient)
+
+        start = time.time()
+        for i in range(0, len(spans), 100):
+            exporter.export(spans[i : i + 100])
+        exporter.stop()
+        elapsed = time.time() - start
+
+        return elapsed, server.requests, client._pool.num_connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--spans", type=int, default=60000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    spans = make_spans(args.spans)
+    baseline = None
+    print("shards  seconds  requests  connections  spans/s  speedup")
+    for shards in args.shards:
+        elapsed, requests, connections = run(shards, spans, args.latency)
+        throughput = len(spans) / elapsed
+        baseline = baseline or throughput
+        print(
+            "{:>6}  {:>7.2f}  {:>8}  {:>11}  {:>7.0f}  {:>6.2f}x".format(
+                shards,
+                elapsed,
+                requests,
+                connections,
+                throughput,
+                throughput / baseline,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
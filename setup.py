@@ -12,4 +12,5 @@ version = "{version!s}"
 """,
     },
     install_requires=("opencensus~=0.7", "newrelic-telemetry-sdk>=0.4.0,<0.5"),
+    extras_require={"numpy": ("numpy",)},
 )
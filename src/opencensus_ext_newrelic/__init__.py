@@ -12,12 +12,48 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from opencensus_ext_newrelic.trace import NewRelicTraceExporter
-from opencensus_ext_newrelic.stats import NewRelicStatsExporter
+import sys
 
 try:
     from opencensus_ext_newrelic.version import version as __version__
 except ImportError:  # pragma: no cover
     __version__ = "unknown"  # pragma: no cover
 
-__all__ = ("NewRelicTraceExporter", "NewRelicStatsExporter")
+__all__ = (
+    "NewRelicExporter",
+    "NewRelicTraceExporter",
+    "NewRelicStatsExporter",
+    "CircuitBreaker",
+    "Shaper",
+)
+
+# Exported names are resolved on first access so that a process using only
+# tracing never imports the opencensus stats machinery (and vice versa).
+_LAZY_ATTRIBUTES = {
+    "NewRelicExporter": "opencensus_ext_newrelic.exporter",
+    "NewRelicTraceExporter": "opencensus_ext_newrelic.trace",
+    "NewRelicStatsExporter": "opencensus_ext_newrelic.stats",
+    "CircuitBreaker": "opencensus_ext_newrelic.circuit",
+    "Shaper": "opencensus_ext_newrelic.shaping",
+}
+
+if sys.version_info >= (3, 7):
+
+    def __getattr__(name):
+        module_name = _LAZY_ATTRIBUTES.get(name)
+        if module_name is None:
+            raise AttributeError(
+                "module {!r} has no attribute {!r}".format(__name__, name)
+            )
+
+        value = getattr(__import__(module_name, fromlist=[name]), name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+else:  # pragma: no cover
+    # Module level __getattr__ is not supported (PEP 562)
+    for _name, _module_name in _LAZY_ATTRIBUTES.items():
+        globals()[_name] = getattr(__import__(_module_name, fromlist=[_name]), _name)
@@ -0,0 +1,394 @@
+# Copyright 2019 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import functools
+import logging
+import threading
+import uuid
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue  # pragma: no cover
+
+from opencensus.trace import execution_context
+from opencensus_ext_newrelic.circuit import CircuitBreaker
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic  # pragma: no cover
+
+try:
+    from opencensus_ext_newrelic.version import version as __version__
+except ImportError:  # pragma: no cover
+    __version__ = "unknown"  # pragma: no cover
+
+_logger = logging.getLogger(__name__)
+_MISSING = object()
+
+# The longest wait between two attempts to send a payload to a destination,
+# unless the destination asks for a longer one
+MAX_RETRY_DELAY = 30.0
+
+
+def _create_client(client_cls, insert_key, host, port):
+    client = client_cls(insert_key=insert_key, host=host, port=port)
+    client.add_version_info("NewRelic-OpenCensus-Exporter", __version__)
+    return client
+
+
+def client_factory(client_cls, insert_key, host=None, port=443):
+    """Return a callable creating a client tagged with the exporter version"""
+    return functools.partial(_create_client, client_cls, insert_key, host, port)
+
+
+class LazyClient(object):
+    """Descriptor creating an exporter's HTTP client on first access
+
+    The owning instance must define ``_client`` and ``_client_factory``
+    attributes. Assigning or deleting the attribute replaces the client and
+    disables lazy construction.
+    """
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        client = instance._client
+        if client is None and instance._client_factory is not None:
+            client = instance._client = instance._client_factory()
+            instance._client_factory = None
+        return client
+
+    def __set__(self, instance, value):
+        instance._client = value
+        instance._client_factory = None
+
+    def __delete__(self, instance):
+        self.__set__(instance, None)
+
+
+def encode_batch(client, items, common=None):
+    """Return the compressed request body ``client.send_batch`` would send"""
+    return client._create_payload(items, common)
+
+
+def send_payload(client, payload, timeout=None):
+    """Send a request body created by :func:`encode_batch`
+
+    This mirrors ``send_batch`` of the telemetry SDK clients without encoding
+    the items again.
+    """
+    # Specifying the headers argument overrides any base headers existing in
+    # the pool, so we must copy all existing headers
+    headers = client._headers.copy()
+    headers["x-request-id"] = str(uuid.uuid4())
+    return client._pool.urlopen(
+        "POST", client.PATH, body=payload, headers=headers, timeout=timeout
+    )
+
+
+def grow_pool(client, maxsize):
+    """Keep up to ``maxsize`` idle connections in the pool of a client
+
+    The telemetry SDK clients keep a single idle connection, so threads
+    sending through one client at the same time would open a connection for
+    most requests and discard it afterwards. The pool must be grown before
+    any request is sent.
+    """
+    pool = client._pool
+    idle = pool.pool
+    if idle is None or idle.maxsize >= maxsize:
+        return
+
+    grown = pool.QueueCls(maxsize)
+    while True:
+        try:
+            grown.put(idle.get(block=False))
+        except queue.Empty:
+            break
+    while not grown.full():
+        grown.put(None)
+    pool.pool = grown
+
+
+def hoist_common_attributes(items, common, exclude=()):
+    """Move attributes shared by every item into the common block
+
+    An attribute is moved when every item has it with the same value and the
+    common block does not already set it to another value. The attributes of
+    the items are modified in place.
+
+    :param items: The spans or metrics of a batch
+    :type items: list
+    :param common: The common block of the batch
+    :type common: dict
+    :param exclude: (optional) Attributes which are never moved
+    :type exclude: tuple
+    :returns: The common block to send with the items
+    :rtype: dict
+    """
+    if len(items) < 2:
+        return common
+
+    shared = None
+    for item in items:
+        attributes = item.get("attributes")
+        if not attributes:
+            return common
+
+        if shared is None:
+            shared = {
+                key: value for key, value in attributes.items() if key not in exclude
+            }
+        else:
+            for key, value in list(shared.items()):
+                other = attributes.get(key, _MISSING)
+                if other is not value and (
+                    type(other) is not type(value) or other != value
+                ):
+                    del shared[key]
+
+        if not shared:
+            return common
+
+    common_attributes = common.get("attributes") or {}
+    for key, value in list(shared.items()):
+        if common_attributes.get(key, value) != value:
+            del shared[key]
+    if not shared:
+        return common
+
+    for item in items:
+        attributes = item["attributes"]
+        for key in shared:
+            del attributes[key]
+        if not attributes:
+            del item["attributes"]
+
+    hoisted = dict(common)
+    hoisted["attributes"] = dict(common_attributes)
+    hoisted["attributes"].update(shared)
+    return hoisted
+
+
+class Destination(object):
+    """An additional account or endpoint receiving a copy of every payload
+
+    Payloads are sent from a dedicated background thread so a slow or failing
+    destination never delays the exporter or the other destinations. Failed
+    payloads are retried up to ``max_retries`` times, waiting ``retry_delay``
+    seconds before the first retry and twice as long before each following
+    one, or as long as the ``Retry-After`` header of a 429 response asks.
+    Sends are suspended while the destination's circuit breaker is open, and
+    paced by the ``shaper``, if any.
+
+    :ivar sent: The number of payloads accepted by the destination
+    :ivar failed: The number of failed send attempts
+    :ivar dropped: The number of payloads dropped because the queue was full,
+        all retries failed or the destination stopped before a retry
+    """
+
+    client = LazyClient()
+
+    def __init__(
+        self,
+        client_factory,
+        circuit_breaker,
+        max_pending=10,
+        max_retries=3,
+        shaper=None,
+        retry_delay=1.0,
+    ):
+        self.circuit_breaker = circuit_breaker
+        self.shaper = shaper
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.sent = self.failed = self.dropped = 0
+
+        self._client = None
+        self._client_factory = client_factory
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    @property
+    def counters(self):
+        """A dict of the destination counters and the number of pending
+        payloads"""
+        with self._condition:
+            return {
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "pending": len(self._pending),
+            }
+
+    def publish(self, payload):
+        """Queue a payload for sending"""
+        with self._condition:
+            if self._stopped:
+                return
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._thread_main, name="NewRelic Destination Worker"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._pending.append([payload, 0])
+            if len(self._pending) > self.max_pending:
+                self._pending.popleft()
+                self.dropped += 1
+            self._condition.notify()
+
+    def _next(self):
+        with self._condition:
+            while not self._pending and not self._stopped:
+                self._condition.wait()
+            if self._pending:
+                return self._pending.popleft()
+
+    def _thread_main(self):
+        # Suppress tracking of requests made by this thread
+        execution_context.set_is_exporter(True)
+
+        breaker = self.circuit_breaker
+        while True:
+            entry = self._next()
+            if entry is None:
+                return
+
+            if not breaker.allow_request():
+                with self._condition:
+                    if self._stopped:
+                        self.dropped += 1 + len(self._pending)
+                        self._pending.clear()
+                        return
+                    self._pending.appendleft(entry)
+                    self._condition.wait(1.0)
+                continue
+
+            if self.shaper is not None:
+                self.shaper.acquire(len(entry[0]))
+
+            try:
+                response = send_payload(self.client, entry[0])
+            except Exception:
+                response = None
+                _logger.exception(
+                    "New Relic destination send failed with an exception."
+                )
+
+            breaker.record_response(response)
+            with self._condition:
+                if response is not None and response.ok:
+                    self.sent += 1
+                    continue
+
+                self.failed += 1
+                entry[1] += 1
+                retryable = response is None or response.status == 429
+                retryable = retryable or response.status >= 500
+                if not retryable or entry[1] > self.max_retries:
+                    self.dropped += 1
+                    continue
+
+                # Back off before retrying. Publishing new payloads does not
+                # end the wait, stopping the destination drops the payload.
+                retry_at = monotonic() + self._backoff(response, entry[1])
+                while not self._stopped:
+                    delay = retry_at - monotonic()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+
+                if self._stopped:
+                    self.dropped += 1
+                else:
+                    self._pending.appendleft(entry)
+
+    def _backoff(self, response, attempts):
+        # The seconds to wait before the next attempt to send a payload
+        if response is not None and response.status == 429:
+            try:
+                return max(float(response.headers.get("Retry-After")), 0)
+            except (TypeError, ValueError):
+                pass
+        return min(self.retry_delay * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+    def _signal_stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            return self._thread
+
+    def stop(self, timeout=None):
+        """Send pending payloads and terminate the background thread"""
+        thread = self._signal_stop()
+        if thread is not None:
+            thread.join(timeout)
+
+
+class Fanout(object):
+    """Send every encoded payload to additional destinations
+
+    :param client_cls: The telemetry SDK client type used for each
+        destination.
+    :type client_cls: type
+    :param destinations: The keyword arguments (``insert_key`` and optionally
+        ``host`` and ``port``) of each destination.
+    :type destinations: list
+    :param shaper: (optional) Paces the requests of all destinations.
+    :type shaper: :class:`opencensus_ext_newrelic.Shaper`
+    """
+
+    def __init__(self, client_cls, destinations, shaper=None):
+        self.destinations = tuple(
+            Destination(
+                client_factory(
+                    client_cls,
+                    destination["insert_key"],
+                    destination.get("host"),
+                    destination.get("port", 443),
+                ),
+                CircuitBreaker(),
+                shaper=shaper,
+            )
+            for destination in destinations
+        )
+
+    def publish(self, payload):
+        for destination in self.destinations:
+            destination.publish(payload)
+
+    @property
+    def counters(self):
+        """A list of counters for each destination"""
+        return [destination.counters for destination in self.destinations]
+
+    def stop(self, timeout=None):
+        """Stop all destinations, waiting at most ``timeout`` seconds overall"""
+        threads = [destination._signal_stop() for destination in self.destinations]
+        deadline = None if timeout is None else monotonic() + timeout
+        for thread in threads:
+            if thread is not None:
+                thread.join(
+                    None if deadline is None else max(deadline - monotonic(), 0)
+                )
@@ -0,0 +1,182 @@
+# Copyright 2019 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+# Views with at least this many series compute their deltas with numpy (when
+# it is installed). Below this size the array overhead outweighs the gain.
+VECTORIZE_MIN_SERIES = 512
+
+
+class DeltaState(object):
+    """Cumulative values reported by the series of a single view
+
+    Each series is assigned a row in a set of columns (for example count and
+    sum). :meth:`update` computes the delta between the values passed in and
+    the previously stored values for every series at once. :meth:`compute`
+    does the same without storing the values until :meth:`commit` is called,
+    so deltas that were never sent are reported again the next time.
+
+    A series that has not been seen before reports its raw values. If the
+    ``reset_column`` value of a series decreases, the cumulative value was
+    reset and the raw values are reported as well.
+
+    :param kinds: The type of each column, ``int`` or ``float``
+    :type kinds: tuple
+    :param reset_column: (optional) The index of a monotonic column used to
+        detect resets.
+    :type reset_column: int
+
+    :ivar signature: A summary of the values last passed to :meth:`update`,
+        set by the owner to detect views that did not change
+    """
+
+    def __init__(self, kinds, reset_column=None):
+        self.kinds = kinds
+        self.reset_column = reset_column
+        self.index = {}
+        self.columns = [[] for _ in kinds]
+        self.vectorized = False
+        self.signature = None
+        self._pending = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def update(self, keys, rows):
+        """Store new cumulative values and return the deltas
+
+        :param keys: A hashable key identifying each series
+        :type keys: list
+        :param rows: A tuple of column values for each series
+        :type rows: list
+        :returns: A tuple of column deltas for each series
+        :rtype: list
+        """
+        deltas = self.compute(keys, rows)
+        self.commit()
+        return deltas
+
+    def compute(self, keys, rows):
+        """Return the deltas without storing the new cumulative values
+
+        The values are stored by the next call to :meth:`commit`. Until then
+        the deltas are computed from the previously committed values.
+
+        :param keys: A hashable key identifying each series
+        :type keys: list
+        :param rows: A tuple of column values for each series
+        :type rows: list
+        :returns: A tuple of column deltas for each series
+        :rtype: list
+        """
+        if not self.vectorized and numpy is not None:
+            if len(self.index) + len(keys) >= VECTORIZE_MIN_SERIES:
+                self._vectorize()
+
+        if self.vectorized:
+            return self._compute_vectorized(keys, rows)
+        return self._compute(keys, rows)
+
+    def commit(self):
+        """Store the values passed to the last call to :meth:`compute`"""
+        pending = self._pending
+        if pending is None:
+            return
+        self._pending = None
+
+        if self.vectorized:
+            ids, current = pending
+            for value, column in zip(current, self.columns):
+                column[ids] = value
+        else:
+            for i, row in pending:
+                for value, column in zip(row, self.columns):
+                    column[i] = value
+
+    def _vectorize(self):
+        self.columns = [
+            numpy.array(column, dtype=self._dtype(kind))
+            for kind, column in zip(self.kinds, self.columns)
+        ]
+        self.vectorized = True
+
+    @staticmethod
+    def _dtype(kind):
+        return numpy.int64 if kind is int else numpy.float64
+
+    def _compute(self, keys, rows):
+        index = self.index
+        columns = self.columns
+        kinds = self.kinds
+        reset_column = self.reset_column
+
+        deltas = []
+        pending = []
+        for key, row in zip(keys, rows):
+            row = tuple(kind(value) for kind, value in zip(kinds, row))
+
+            i = index.get(key)
+            if i is None:
+                i = index[key] = len(index)
+                for column in columns:
+                    column.append(0)
+
+            delta = tuple(value - column[i] for value, column in zip(row, columns))
+            if reset_column is not None and delta[reset_column] < 0:
+                delta = row
+
+            pending.append((i, row))
+            deltas.append(delta)
+
+        self._pending = pending
+        return deltas
+
+    def _compute_vectorized(self, keys, rows):
+        index = self.index
+        ids = []
+        for key in keys:
+            i = index.get(key)
+            if i is None:
+                i = index[key] = len(index)
+            ids.append(i)
+
+        # Grow the columns geometrically so new series rarely reallocate
+        size = len(index)
+        capacity = len(self.columns[0])
+        if size > capacity:
+            capacity = max(size, capacity * 2)
+            for c, column in enumerate(self.columns):
+                grown = numpy.zeros(capacity, dtype=column.dtype)
+                grown[: len(column)] = column
+                self.columns[c] = grown
+
+        ids = numpy.array(ids, dtype=numpy.intp)
+        current = [
+            numpy.array([row[c] for row in rows], dtype=column.dtype)
+            for c, column in enumerate(self.columns)
+        ]
+        deltas = [value - column[ids] for value, column in zip(current, self.columns)]
+
+        if self.reset_column is not None:
+            reset = deltas[self.reset_column] < 0
+            if reset.any():
+                for delta, value in zip(deltas, current):
+                    delta[reset] = value[reset]
+
+        self._pending = (ids, current)
+        return list(zip(*(delta.tolist() for delta in deltas)))
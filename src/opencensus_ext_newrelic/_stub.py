@@ -0,0 +1,116 @@
+# Copyright 2019 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local stand-in for the New Relic ingest APIs used for benchmarking"""
+
+import threading
+import time
+
+import urllib3
+from newrelic_telemetry_sdk.client import HTTPResponse
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class _HTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ResponseCls = HTTPResponse
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        with server.lock:
+            server.requests += 1
+            server.bytes_received += length
+
+        self.send_response(server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """An HTTP server accepting any POST request
+
+    The server runs in a background thread once started and counts the
+    requests and payload bytes it receives.
+
+    :param latency: (optional) Seconds to wait before responding.
+    :type latency: float
+    :param status: (optional) The response status code. Default is 202.
+    :type status: int
+
+    Usage::
+
+        >>> from newrelic_telemetry_sdk import SpanClient
+        >>> with StubServer() as server:
+        ...     response = server.client(SpanClient).send({})
+        >>> response.status, server.requests
+        (202, 1)
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0, status=202):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.status = status
+        self.lock = threading.Lock()
+        self.requests = self.bytes_received = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def client(self, client_cls):
+        """Create a telemetry SDK client sending to this server over HTTP
+
+        :param client_cls: The telemetry SDK client type, for example
+            :class:`newrelic_telemetry_sdk.SpanClient`.
+        :type client_cls: type
+        """
+        cls = type(
+            client_cls.__name__, (client_cls,), {"POOL_CLS": _HTTPConnectionPool}
+        )
+        host, port = self.server_address
+        return cls("stub-insert-key", host=host, port=port)
@@ -0,0 +1,327 @@
+# Copyright 2019 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Capture the data passed to the exporters for deterministic replay
+
+A capture is a gzip compressed file of JSON lines. The first line is a header
+identifying the format and version. Every other line is a record
+``[kind, offset, payload]`` where ``offset`` is the number of seconds since
+the capture started and ``kind`` is one of:
+
+* ``"v"``: a view definition, recorded before the first metrics of the view
+* ``"s"``: the list of spans passed to one
+  :meth:`NewRelicTraceExporter.export` call
+* ``"m"``: the list of metrics passed to one
+  :meth:`NewRelicStatsExporter.export_metrics` call
+
+Captures are replayed with ``python -m opencensus_ext_newrelic.replay``.
+"""
+
+import calendar
+import gzip
+import json
+import threading
+from datetime import datetime, timedelta
+
+from opencensus.metrics import label_key, label_value
+from opencensus.metrics.export import metric as metric_module
+from opencensus.metrics.export import metric_descriptor, point, time_series, value
+from opencensus.stats import aggregation, measure, view
+from opencensus.trace import span_context, status
+from opencensus.trace.span_data import SpanData
+from opencensus_ext_newrelic.recording import bucket_boundaries
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic  # pragma: no cover
+
+FORMAT = "opencensus-ext-newrelic-capture"
+VERSION = 1
+
+_EPOCH = datetime(1970, 1, 1)
+_AGGREGATIONS = {
+    aggregation.CountAggregation: "count",
+    aggregation.SumAggregation: "sum",
+    aggregation.LastValueAggregation: "last",
+    aggregation.DistributionAggregation: "distribution",
+}
+
+
+def _timestamp_to_mus(timestamp):
+    return calendar.timegm(timestamp.utctimetuple()) * 1000000 + timestamp.microsecond
+
+
+def _encode_span(span_data):
+    return [
+        span_data.name,
+        span_data.context.trace_id,
+        span_data.span_id,
+        span_data.parent_span_id,
+        span_data.start_time,
+        span_data.end_time,
+        span_data.attributes or None,
+        span_data.status.code if span_data.status is not None else None,
+        span_data.span_kind,
+    ]
+
+
+def _decode_span(record, _fields=dict.fromkeys(SpanData._fields)):
+    (
+        name,
+        trace_id,
+        span_id,
+        parent_span_id,
+        start_time,
+        end_time,
+        attributes,
+        status_code,
+        span_kind,
+    ) = record
+    fields = _fields.copy()
+    fields.update(
+        name=name,
+        context=span_context.SpanContext(trace_id=trace_id, span_id=span_id),
+        span_id=span_id,
+        parent_span_id=parent_span_id,
+        start_time=start_time,
+        end_time=end_time,
+        attributes=attributes or {},
+        status=status.Status(status_code) if status_code is not None else None,
+        span_kind=span_kind,
+    )
+    return SpanData(**fields)
+
+
+def _encode_view(view_):
+    measure_ = view_.measure
+    return [
+        view_.name,
+        view_.description,
+        list(view_.columns),
+        measure_.name,
+        measure_.description,
+        measure_.unit,
+        "int" if isinstance(measure_, measure.MeasureInt) else "float",
+        _AGGREGATIONS[type(view_.aggregation)],
+        list(bucket_boundaries(view_.aggregation)),
+    ]
+
+
+def _decode_view(record):
+    (
+        name,
+        description,
+        columns,
+        measure_name,
+        measure_description,
+        measure_unit,
+        measure_type,
+        aggregation_name,
+        boundaries,
+    ) = record
+    if measure_type == "int":
+        measure_ = measure.MeasureInt(measure_name, measure_description, measure_unit)
+    else:
+        measure_ = measure.MeasureFloat(measure_name, measure_description, measure_unit)
+
+    if aggregation_name == "count":
+        aggregation_ = aggregation.CountAggregation()
+    elif aggregation_name == "sum":
+        aggregation_ = aggregation.SumAggregation()
+    elif aggregation_name == "last":
+        aggregation_ = aggregation.LastValueAggregation()
+    else:
+        aggregation_ = aggregation.DistributionAggregation(boundaries)
+
+    return view.View(name, description, columns, measure_, aggregation_)
+
+
+def _encode_value(value_):
+    if isinstance(value_, value.ValueDistribution):
+        bucket_type = value_.bucket_options.type_
+        return [
+            value_.count,
+            value_.sum,
+            value_.sum_of_squared_deviation,
+            list(bucket_type.bounds) if bucket_type is not None else None,
+            [bucket.count for bucket in value_.buckets or ()],
+        ]
+    return value_.value
+
+
+def _decode_value(encoded, descriptor_type):
+    if isinstance(encoded, list):
+        count, sum_, ssd, bounds, bucket_counts = encoded
+        if bounds is None:
+            return value.ValueDistribution(count, sum_, ssd, value.BucketOptions())
+        return value.ValueDistribution(
+            count,
+            sum_,
+            ssd,
+            value.BucketOptions(value.Explicit(bounds)),
+            [value.Bucket(bucket_count) for bucket_count in bucket_counts],
+        )
+
+    value_type = metric_descriptor.MetricDescriptorType.to_type_class(descriptor_type)
+    return value_type(encoded)
+
+
+def _encode_metric(metric):
+    descriptor = metric.descriptor
+    series = []
+    for timeseries in metric.time_series:
+        point_ = timeseries.points[0]
+        series.append(
+            [
+                [label.value for label in timeseries.label_values],
+                _timestamp_to_mus(point_.timestamp),
+                _encode_value(point_.value),
+            ]
+        )
+    return [
+        descriptor.name,
+        descriptor.type,
+        [key.key for key in descriptor.label_keys],
+        series,
+    ]
+
+
+def _decode_metric(record):
+    name, descriptor_type, keys, series = record
+    descriptor = metric_descriptor.MetricDescriptor(
+        name, "", "", descriptor_type, [label_key.LabelKey(key, "") for key in keys]
+    )
+    decoded = []
+    for labels, timestamp_mus, encoded in series:
+        timestamp = _EPOCH + timedelta(microseconds=timestamp_mus)
+        decoded.append(
+            time_series.TimeSeries(
+                [label_value.LabelValue(label) for label in labels],
+                [point.Point(_decode_value(encoded, descriptor_type), timestamp)],
+                timestamp,
+            )
+        )
+    return metric_module.Metric(descriptor, decoded)
+
+
+class Recorder(object):
+    """Record the data passed to the exporters into a capture file
+
+    Pass the same recorder to the exporters using their ``recorder``
+    argument. Recording is thread safe.
+
+    :param path: The path of the capture file to write.
+    :type path: str
+
+    Usage::
+
+        >>> import os, tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), "workload.nrcap")
+        >>> with Recorder(path) as recorder:
+        ...     recorder.record_spans([])
+        >>> [kind for kind, offset, payload in read_capture(path)]
+        ['s']
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._views = set()
+        self._start = monotonic()
+        self._file = gzip.open(path, "wb")
+        self._write({"format": FORMAT, "version": VERSION})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        self._file.write(line.encode("utf-8"))
+
+    def _record(self, kind, payload):
+        self._write([kind, round(monotonic() - self._start, 6), payload])
+
+    def record_spans(self, span_datas):
+        """Record one list of spans passed to the trace exporter
+
+        :param span_datas: list of :class:`opencensus.trace.span_data.SpanData`
+        :type span_datas: list
+        """
+        spans = [_encode_span(span_data) for span_data in span_datas]
+        with self._lock:
+            if self._file is not None:
+                self._record("s", spans)
+
+    def record_metrics(self, metrics, views):
+        """Record one list of metrics passed to the stats exporter
+
+        :param metrics: list of :class:`opencensus.metrics.export.metric.Metric`
+        :type metrics: list
+        :param views: The views registered with the exporter, by name
+        :type views: dict
+        """
+        encoded = [_encode_metric(metric) for metric in metrics]
+        with self._lock:
+            if self._file is None:
+                return
+
+            for metric in metrics:
+                name = metric.descriptor.name
+                if name not in self._views and name in views:
+                    self._views.add(name)
+                    self._record("v", _encode_view(views[name]))
+
+            self._record("m", encoded)
+
+    def close(self):
+        """Flush and close the capture file"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_capture(path):
+    """Read the records of a capture file
+
+    Spans, metrics and views are decoded into the opencensus types passed to
+    the exporters.
+
+    :param path: The path of the capture file.
+    :type path: str
+    :returns: An iterator of ``(kind, offset, payload)`` tuples.
+    :raises ValueError: if the file is not a supported capture.
+    """
+    with gzip.open(path, "rb") as capture:
+        header = json.loads(capture.readline().decode("utf-8") or "null")
+        if not isinstance(header, dict) or header.get("format") != FORMAT:
+            raise ValueError("{} is not a capture file".format(path))
+        if header.get("version") != VERSION:
+            raise ValueError(
+                "Unsupported capture version: {!r}".format(header.get("version"))
+            )
+
+        for line in capture:
+            kind, offset, payload = json.loads(line.decode("utf-8"))
+            if kind == "s":
+                payload = [_decode_span(span) for span in payload]
+            elif kind == "m":
+                payload = [_decode_metric(metric) for metric in payload]
+            elif kind == "v":
+                payload = _decode_view(payload)
+            yield kind, offset, payload
@@ -0,0 +1,147 @@
+# Copyright 2019 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic  # pragma: no cover
+
+_logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker(object):
+    """Stop sending data to an endpoint that is consistently failing
+
+    After ``failure_threshold`` consecutive failed requests the circuit opens
+    and :meth:`allow_request` returns False for ``cooldown`` seconds. Once the
+    cooldown has elapsed, a single probe request is allowed through
+    (half-open). A successful probe closes the circuit; a failed probe opens
+    it again for another cooldown.
+
+    A single breaker may be shared by the trace and stats exporters so that an
+    outage detected by one of them stops both.
+
+    :param failure_threshold: (optional) The number of consecutive failures
+        required to open the circuit. Default is 5.
+    :type failure_threshold: int
+    :param cooldown: (optional) The number of seconds to wait before probing
+        the endpoint once the circuit is open. Default is 30 seconds.
+    :type cooldown: int or float
+
+    Usage::
+
+        >>> breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+        >>> breaker.record_failure()
+        >>> breaker.state
+        'open'
+        >>> breaker.allow_request()
+        False
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def state(self):
+        """The current state: ``closed``, ``open`` or ``half-open``"""
+        return self._state
+
+    def would_allow(self):
+        """Return True if :meth:`allow_request` would allow a request
+
+        Unlike :meth:`allow_request`, the state is left unchanged, so the
+        probe of a half-open circuit is kept for the request that is
+        eventually sent.
+
+        :rtype: bool
+        """
+        with self._lock:
+            return (
+                self._state == CLOSED or monotonic() - self._opened_at >= self.cooldown
+            )
+
+    def allow_request(self):
+        """Return True if a request should be attempted
+
+        Call this immediately before sending: once the cooldown has elapsed,
+        the call uses up the probe.
+
+        :rtype: bool
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+
+            if monotonic() - self._opened_at < self.cooldown:
+                return False
+
+            # Allow a single probe through. Restarting the cooldown here
+            # guarantees another probe is allowed later even if the result of
+            # this one is never recorded.
+            self._state = HALF_OPEN
+            self._opened_at = monotonic()
+            return True
+
+    def record_success(self):
+        """Record a successful request, closing the circuit"""
+        with self._lock:
+            if self._state != CLOSED:
+                _logger.info("New Relic endpoint recovered, resuming sends.")
+            self._state = CLOSED
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        """Record a failed request, opening the circuit if required"""
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (
+                self._state == CLOSED and self._failures >= self.failure_threshold
+            ):
+                if self._state == CLOSED:
+                    _logger.warning(
+                        "New Relic endpoint failed %d consecutive requests. "
+                        "Suspending sends for %s seconds.",
+                        self._failures,
+                        self.cooldown,
+                    )
+                self._state = OPEN
+                self._opened_at = monotonic()
+
+    def record_response(self, response):
+        """Record the outcome of a request
+
+        Exceptions (a ``None`` response), throttling (429) and server errors
+        count as failures. Any other response means the endpoint is reachable.
+
+        :param response: The response object or None if the request raised an
+            exception.
+        :type response: :class:`newrelic_telemetry_sdk.client.HTTPResponse`
+        """
+        if response is None or response.status == 429 or response.status >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
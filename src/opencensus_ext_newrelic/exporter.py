@@ -0,0 +1,325 @@
+# Copyright 2019 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import functools
+import logging
+import threading
+
+from opencensus.stats.view_data import ViewData
+from opencensus.trace import base_exporter
+from opencensus.trace import execution_context
+from opencensus_ext_newrelic import lifecycle
+from opencensus_ext_newrelic.circuit import CircuitBreaker
+from opencensus_ext_newrelic.lifecycle import deadline, remaining
+from opencensus_ext_newrelic.stats import NewRelicStatsExporter
+from opencensus_ext_newrelic.trace import DefaultTransport, NewRelicTraceExporter
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic  # pragma: no cover
+
+_logger = logging.getLogger(__name__)
+
+
+class Task(object):
+    """A periodic function run by a :class:`Scheduler`
+
+    :ivar interval: The number of seconds between runs
+    """
+
+    def __init__(self, scheduler, interval, function, next_run):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.function = function
+        self.next_run = next_run
+
+    def cancel(self):
+        """Stop running the function"""
+        self.scheduler._cancel(self)
+
+
+class Scheduler(object):
+    """Run periodic tasks from a single background thread
+
+    Task intervals are counted from the creation of the scheduler, so tasks
+    sharing an interval (or a multiple of it) run during the same wake-up.
+
+    :param name: (optional) The name of the background thread.
+    :type name: str
+    """
+
+    def __init__(self, name="NewRelicExporter Worker"):
+        self._condition = threading.Condition()
+        self._tasks = []
+        self._stopped = False
+        self._start = monotonic()
+
+        self._thread = threading.Thread(target=self._thread_main, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def schedule(self, interval, function):
+        """Call ``function`` every ``interval`` seconds
+
+        :param interval: The number of seconds between calls.
+        :type interval: int or float
+        :param function: The function to call, without arguments.
+        :type function: callable
+        :rtype: :class:`Task`
+        """
+        with self._condition:
+            # Align the first run with the runs of existing tasks
+            elapsed = monotonic() - self._start
+            next_run = self._start + interval * (int(elapsed // interval) + 1)
+            task = Task(self, interval, function, next_run)
+            self._tasks.append(task)
+            self._condition.notify()
+        return task
+
+    def _cancel(self, task):
+        with self._condition:
+            if task in self._tasks:
+                self._tasks.remove(task)
+
+    def _due(self):
+        with self._condition:
+            while not self._stopped:
+                now = monotonic()
+                due = [task for task in self._tasks if task.next_run <= now]
+                if due:
+                    # Runs missed while a task was busy are skipped
+                    for task in due:
+                        missed = int((now - task.next_run) // task.interval)
+                        task.next_run += task.interval * (missed + 1)
+                    return due
+
+                timeout = None
+                if self._tasks:
+                    timeout = min(task.next_run for task in self._tasks) - now
+                self._condition.wait(timeout)
+
+    def _thread_main(self):
+        # Suppress tracking of requests made by this thread
+        execution_context.set_is_exporter(True)
+
+        while True:
+            due = self._due()
+            if due is None:
+                return
+
+            for task in due:
+                try:
+                    task.function()
+                except Exception:
+                    _logger.exception("New Relic scheduled export failed.")
+
+    def stop(self, timeout=None):
+        """Terminate the background thread
+
+        :param timeout: (optional) The number of seconds to wait for a running
+            task to complete. Defaults to waiting indefinitely.
+        :type timeout: int or float
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+
+class _ScheduledTransport(DefaultTransport):
+    # Sends queued spans from a shared scheduler instead of a dedicated thread
+
+    def __init__(self, exporter, scheduler, **kwargs):
+        self.scheduler = scheduler
+        super(_ScheduledTransport, self).__init__(exporter, **kwargs)
+
+    def _start(self):
+        self._task = self.scheduler.schedule(self.wait_period, self._export_pending)
+
+    def stop(self, timeout=None):
+        self._task.cancel()
+        if timeout is None:
+            timeout = self.grace_period
+        return self.flush(timeout)
+
+
+class _ScheduledStatsExporter(NewRelicStatsExporter):
+    # Collects metrics from a shared scheduler instead of a dedicated thread
+
+    def __init__(self, scheduler, *args, **kwargs):
+        self.scheduler = scheduler
+        super(_ScheduledStatsExporter, self).__init__(*args, **kwargs)
+
+    def _schedule(self, interval):
+        return self.scheduler.schedule(interval, self.flush)
+
+
+def _shared_pool_client(client_factory, pools):
+    # Clients sending to the same host and port share a connection pool
+    client = client_factory()
+    pool = client._pool
+    shared = pools.setdefault((pool.host, pool.port), pool)
+    if shared is not pool:
+        pool.close()
+        client._pool = shared
+    return client
+
+
+class NewRelicExporter(base_exporter.Exporter):
+    """Export spans and metrics to the New Relic platform from one thread
+
+    A single scheduler thread sends queued spans every ``wait_period``
+    seconds and collects metrics every ``interval`` seconds. With equal
+    periods, spans and metrics are sent during the same wake-up. Both use a
+    shared circuit breaker, and share a connection pool when they are sent to
+    the same host.
+
+    The exporter is used as the exporter of a tracer and is registered with
+    the view manager like :class:`NewRelicStatsExporter`.
+
+    :param insert_key: Insights insert key
+    :type insert_key: str
+    :param service_name: The name of this application.
+    :type service_name: str
+    :param interval: (optional) Metrics will be sent every ``interval``
+        seconds. Default is 5 seconds.
+    :type interval: int or float
+    :param wait_period: (optional) Queued spans will be sent every
+        ``wait_period`` seconds. Default is 5 seconds.
+    :type wait_period: int or float
+    :param host: (optional) Override the host for the span and metric API
+        endpoints.
+    :type host: str
+    :param port: (optional) Override the port for the API endpoints.
+    :type port: int
+    :param circuit_breaker: (optional) A circuit breaker used to suspend
+        sends while the endpoint is failing. Defaults to a new
+        :class:`opencensus_ext_newrelic.CircuitBreaker`.
+    :type circuit_breaker: :class:`opencensus_ext_newrelic.CircuitBreaker`
+    :param shaper: (optional) Limits the combined bandwidth and request rate
+        of spans and metrics. Waiting for the shaper delays the next run of
+        the scheduler.
+    :type shaper: :class:`opencensus_ext_newrelic.Shaper`
+
+    Usage::
+
+        >>> import os
+        >>> from opencensus_ext_newrelic import NewRelicExporter
+        >>> insert_key = os.environ.get("NEW_RELIC_INSERT_KEY")
+        >>> exporter = NewRelicExporter(insert_key, service_name="My Service")
+        >>> exporter.stop()
+    """
+
+    def __init__(
+        self,
+        insert_key,
+        service_name,
+        interval=5,
+        wait_period=5.0,
+        host=None,
+        port=443,
+        circuit_breaker=None,
+        shaper=None,
+    ):
+        circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.scheduler = Scheduler()
+        self.trace_exporter = NewRelicTraceExporter(
+            insert_key,
+            service_name,
+            transport=functools.partial(
+                _ScheduledTransport, scheduler=self.scheduler, wait_period=wait_period
+            ),
+            host=host,
+            port=port,
+            circuit_breaker=circuit_breaker,
+            shaper=shaper,
+        )
+        self.stats_exporter = _ScheduledStatsExporter(
+            self.scheduler,
+            insert_key,
+            service_name,
+            interval=interval,
+            host=host,
+            port=port,
+            circuit_breaker=circuit_breaker,
+            shaper=shaper,
+        )
+
+        pools = {}
+        for exporter in (self.trace_exporter, self.stats_exporter):
+            exporter._client_factory = functools.partial(
+                _shared_pool_client, exporter._client_factory, pools
+            )
+
+        atexit.register(self.stop)
+
+    def emit(self, span_datas):
+        """Immediately send spans, see :meth:`NewRelicTraceExporter.emit`"""
+        return self.trace_exporter.emit(span_datas)
+
+    def export(self, span_datas):
+        """Queue spans, see :meth:`NewRelicTraceExporter.export`
+
+        The view manager also passes the view data of every recorded
+        measurement to its exporters. Metrics are collected every
+        ``interval`` instead, so view data is ignored.
+        """
+        if span_datas and isinstance(span_datas[0], ViewData):
+            return
+        return self.trace_exporter.export(span_datas)
+
+    def on_register_view(self, view):
+        """Called when a view is registered with the view manager"""
+        self.stats_exporter.on_register_view(view)
+
+    def export_metrics(self, metrics):
+        """Immediately send metrics, see
+        :meth:`NewRelicStatsExporter.export_metrics`"""
+        return self.stats_exporter.export_metrics(metrics)
+
+    def flush(self, timeout=None):
+        """Send queued spans and the current metrics in parallel
+
+        :param timeout: (optional) The number of seconds to spend sending.
+            Defaults to sending all pending data.
+        :type timeout: int or float
+        :returns: The number of ``spans`` and ``metrics`` left unsent.
+        :rtype: dict
+        """
+        spans, metrics = lifecycle.flush(
+            [self.trace_exporter, self.stats_exporter], timeout
+        )
+        return {"spans": spans, "metrics": metrics}
+
+    def shutdown(self, timeout=None):
+        """Send pending data in parallel and terminate the scheduler thread
+
+        :param timeout: (optional) The number of seconds to wait for pending
+            data to be sent. Defaults to waiting indefinitely.
+        :type timeout: int or float
+        :returns: The number of ``spans`` and ``metrics`` left unsent.
+        :rtype: dict
+        """
+        end = deadline(timeout)
+        spans, metrics = lifecycle.shutdown(
+            [self.trace_exporter, self.stats_exporter], timeout
+        )
+        self.scheduler.stop(remaining(end))
+        return {"spans": spans, "metrics": metrics}
+
+    def stop(self):
+        """Terminate the exporter and its background thread"""
+        self.shutdown()
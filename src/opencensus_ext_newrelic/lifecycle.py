@@ -0,0 +1,179 @@
+# Copyright 2019 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Flush and shut down exporters within a deadline
+
+Exporters passed to :func:`flush` and :func:`shutdown` run in parallel, so
+traces and metrics share a single deadline rather than waiting on each other.
+Each function returns the amount of data every exporter left unsent.
+
+Usage::
+
+    >>> from opencensus_ext_newrelic import (
+    ...     NewRelicStatsExporter, NewRelicTraceExporter)
+    >>> trace_exporter = NewRelicTraceExporter(None, service_name="My Service")
+    >>> stats_exporter = NewRelicStatsExporter(None, service_name="My Service")
+    >>> shutdown([trace_exporter, stats_exporter], timeout=5)
+    [0, 0]
+"""
+
+import atexit
+import functools
+import logging
+import os
+import signal
+import threading
+
+from opencensus.trace import execution_context
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic  # pragma: no cover
+
+_logger = logging.getLogger(__name__)
+
+
+def deadline(timeout):
+    """Return the monotonic deadline ``timeout`` seconds from now
+
+    :param timeout: The number of seconds, or None for no deadline.
+    :type timeout: int or float
+    """
+    if timeout is None:
+        return None
+    return monotonic() + timeout
+
+
+def remaining(deadline):
+    """Return the number of seconds left until a deadline
+
+    :param deadline: A deadline returned by :func:`deadline`.
+    :type deadline: float
+    :returns: The seconds left, never negative, or None without a deadline.
+    """
+    if deadline is None:
+        return None
+    return max(deadline - monotonic(), 0)
+
+
+def run_parallel(functions, timeout=None):
+    """Call each function in its own thread and wait up to ``timeout`` seconds
+
+    :param functions: The functions to call, without arguments.
+    :type functions: list
+    :param timeout: (optional) The number of seconds to wait for all
+        functions to return. Defaults to waiting indefinitely.
+    :type timeout: int or float
+    :returns: The result of each function, or None if it did not return in
+        time or raised an exception.
+    :rtype: list
+    """
+    results = [None] * len(functions)
+
+    def run(index, function):
+        # Suppress tracking of requests made by this thread
+        execution_context.set_is_exporter(True)
+        try:
+            results[index] = function()
+        except Exception:
+            _logger.exception("New Relic exporter failed to flush.")
+
+    end = deadline(timeout)
+    threads = []
+    for index, function in enumerate(functions):
+        thread = threading.Thread(
+            target=run, args=(index, function), name="NewRelic Flush"
+        )
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join(remaining(end))
+
+    return results
+
+
+def flush(exporters, timeout=None):
+    """Send the pending data of all exporters in parallel
+
+    :param exporters: The trace and stats exporters to flush.
+    :type exporters: list
+    :param timeout: (optional) The number of seconds to wait. Defaults to
+        waiting indefinitely.
+    :type timeout: int or float
+    :returns: The amount of data each exporter left unsent, or None for an
+        exporter that did not finish in time.
+    :rtype: list
+    """
+    return run_parallel(
+        [functools.partial(exporter.flush, timeout) for exporter in exporters],
+        timeout,
+    )
+
+
+def shutdown(exporters, timeout=None):
+    """Send the pending data of all exporters in parallel and terminate them
+
+    :param exporters: The trace and stats exporters to shut down.
+    :type exporters: list
+    :param timeout: (optional) The number of seconds to wait. Defaults to
+        waiting indefinitely.
+    :type timeout: int or float
+    :returns: The amount of data each exporter left unsent, or None for an
+        exporter that did not finish in time.
+    :rtype: list
+    """
+    return run_parallel(
+        [functools.partial(exporter.shutdown, timeout) for exporter in exporters],
+        timeout,
+    )
+
+
+def _on_signal(exporters, timeout, previous, signum, frame):
+    shutdown(exporters, timeout)
+
+    if callable(previous):
+        previous(signum, frame)
+    elif previous in (signal.SIG_DFL, None):
+        # Restore the default action and deliver the signal again so the
+        # process terminates as it would have without the handler.
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
+def register_shutdown(exporters, timeout=5.0, signals=()):
+    """Shut down exporters when the interpreter exits or a signal is received
+
+    The previous handler of each signal is called once the exporters are shut
+    down. Signal handlers can only be installed from the main thread.
+
+    :param exporters: The trace and stats exporters to shut down.
+    :type exporters: list
+    :param timeout: (optional) The number of seconds to wait for pending data
+        to be sent. Default is 5 seconds.
+    :type timeout: int or float
+    :param signals: (optional) The signals to handle, for example
+        ``(signal.SIGTERM,)``. Default is to only shut down at exit.
+    :type signals: tuple
+    """
+    exporters = list(exporters)
+    atexit.register(shutdown, exporters, timeout)
+
+    for signum in signals:
+        previous = signal.getsignal(signum)
+        signal.signal(
+            signum, functools.partial(_on_signal, exporters, timeout, previous)
+        )
@@ -0,0 +1,324 @@
+# Copyright 2019 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Record metrics from many threads without contention
+
+Measurements passed to :meth:`MetricRecorder.record` are aggregated in a
+buffer owned by the recording thread, so recording never waits on a lock.
+The buffers are only merged when the stats exporter collects metrics, and the
+merged values are exported like the metrics of opencensus views.
+"""
+
+import bisect
+import itertools
+import threading
+import weakref
+from datetime import datetime
+
+from opencensus.metrics import label_key, label_value
+from opencensus.metrics.export import metric as metric_module
+from opencensus.metrics.export import metric_descriptor, point, time_series, value
+from opencensus.stats import aggregation
+
+_sequence = itertools.count()
+
+
+def bucket_boundaries(aggregation_):
+    """The bucket boundaries of a distribution aggregation
+
+    Older versions of opencensus wrap the boundaries in a
+    :class:`opencensus.stats.bucket_boundaries.BucketBoundaries`.
+
+    :rtype: tuple
+    """
+    boundaries = getattr(aggregation_, "_boundaries", None)
+    return tuple(getattr(boundaries, "boundaries", boundaries) or ())
+
+
+class _Count(object):
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, _):
+        self.count += 1
+
+    def snapshot(self):
+        return self.count
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+
+class _Sum(object):
+    __slots__ = ("sum",)
+
+    def __init__(self):
+        self.sum = 0
+
+    def add(self, value):
+        self.sum += value
+
+    def snapshot(self):
+        return self.sum
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+
+class _LastValue(object):
+    __slots__ = ("last",)
+
+    def __init__(self):
+        self.last = None
+
+    def add(self, value):
+        # The value is stored together with a global sequence number so the
+        # most recent value of all threads can be found when merging
+        self.last = (next(_sequence), value)
+
+    def snapshot(self):
+        return self.last
+
+    @staticmethod
+    def merge(a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return max(a, b)
+
+
+class _Distribution(object):
+    __slots__ = ("bounds", "count", "sum", "buckets")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = [0] * (len(bounds) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.buckets[bisect.bisect_right(self.bounds, value)] += 1
+
+    def snapshot(self):
+        return (self.count, self.sum, tuple(self.buckets))
+
+    @staticmethod
+    def merge(a, b):
+        return (
+            a[0] + b[0],
+            a[1] + b[1],
+            tuple(x + y for x, y in zip(a[2], b[2])),
+        )
+
+
+class MetricRecorder(object):
+    """Aggregate measurements in per-thread buffers
+
+    Each view is identified by name, and measurements are recorded with the
+    tag values of the view's columns, in order. Count, sum, last value and
+    distribution aggregations are supported.
+
+    Add the recorder to a stats exporter with
+    :meth:`opencensus_ext_newrelic.NewRelicStatsExporter.add_recorder`. Its
+    metrics are then exported every interval.
+
+    :param views: The views recorded.
+    :type views: list
+
+    Usage::
+
+        >>> from opencensus.stats import aggregation, measure, view
+        >>> requests = view.View(
+        ...     "requests", "Requests served", ("method",),
+        ...     measure.MeasureInt("requests", "Requests", "1"),
+        ...     aggregation.CountAggregation())
+        >>> recorder = MetricRecorder([requests])
+        >>> recorder.record("requests", 1, ("GET",))
+        >>> [metric.descriptor.name for metric in recorder.get_metrics()]
+        ['requests']
+    """
+
+    def __init__(self, views):
+        self.views = {view.name: view for view in views}
+        self._factories = {
+            name: self._accumulator_factory(view) for name, view in self.views.items()
+        }
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._buffers = []
+        self._retired = {}
+        self._start_time = datetime.utcnow()
+
+    @staticmethod
+    def _accumulator_factory(view):
+        aggregation_type = type(view.aggregation)
+        if aggregation_type is aggregation.CountAggregation:
+            return _Count
+        elif aggregation_type is aggregation.SumAggregation:
+            return _Sum
+        elif aggregation_type is aggregation.LastValueAggregation:
+            return _LastValue
+
+        bounds = bucket_boundaries(view.aggregation)
+        return lambda: _Distribution(bounds)
+
+    def _new_buffer(self):
+        buffer = self._local.buffer = {}
+        with self._lock:
+            self._buffers.append((weakref.ref(threading.current_thread()), buffer))
+        return buffer
+
+    def record(self, name, value, tag_values=()):
+        """Record a measurement for a view
+
+        :param name: The name of the view.
+        :type name: str
+        :param value: The measured value.
+        :type value: int or float
+        :param tag_values: (optional) The value of each column of the view.
+        :type tag_values: tuple
+        """
+        try:
+            buffer = self._local.buffer
+        except AttributeError:
+            buffer = self._new_buffer()
+
+        key = (name, tag_values)
+        accumulator = buffer.get(key)
+        if accumulator is None:
+            columns = self.views[name].columns
+            if len(tag_values) != len(columns):
+                raise ValueError(
+                    "View {} requires {} tag values".format(name, len(columns))
+                )
+            accumulator = buffer[key] = self._factories[name]()
+        accumulator.add(value)
+
+    def _merge(self):
+        with self._lock:
+            buffers = list(self._buffers)
+            retired = self._retired
+
+            merged = dict(retired)
+            live = []
+            for thread_ref, buffer in buffers:
+                thread = thread_ref()
+                dead = thread is None or not thread.is_alive()
+
+                # Copying is atomic, so the owning thread may keep adding
+                # series while the buffer is merged
+                for key, accumulator in buffer.copy().items():
+                    snapshot = accumulator.snapshot()
+                    previous = merged.get(key)
+                    if previous is not None:
+                        snapshot = accumulator.merge(previous, snapshot)
+                    merged[key] = snapshot
+
+                    # Totals of finished threads are kept so cumulative
+                    # values never decrease
+                    if dead:
+                        previous = retired.get(key)
+                        if previous is not None:
+                            retired[key] = accumulator.merge(
+                                previous, accumulator.snapshot()
+                            )
+                        else:
+                            retired[key] = accumulator.snapshot()
+
+                if not dead:
+                    live.append((thread_ref, buffer))
+
+            self._buffers = live
+        return merged
+
+    def get_metrics(self):
+        """Merge the buffers of all threads into cumulative metrics
+
+        :rtype: list of :class:`opencensus.metrics.export.metric.Metric`
+        """
+        merged = self._merge()
+        timestamp = datetime.utcnow()
+
+        series_by_view = {}
+        for (name, tag_values), snapshot in merged.items():
+            series_by_view.setdefault(name, []).append((tag_values, snapshot))
+
+        metrics = []
+        for name, series in series_by_view.items():
+            view = self.views[name]
+            descriptor_type = view.aggregation.get_metric_type(view.measure)
+            value_type = metric_descriptor.MetricDescriptorType.to_type_class(
+                descriptor_type
+            )
+            bounds = bucket_boundaries(view.aggregation)
+
+            time_series_list = []
+            for tag_values, snapshot in series:
+                if snapshot is None:
+                    continue
+                if value_type is value.ValueDistribution:
+                    point_value = self._distribution_value(snapshot, bounds)
+                elif isinstance(snapshot, tuple):
+                    point_value = value_type(snapshot[1])
+                else:
+                    point_value = value_type(snapshot)
+
+                time_series_list.append(
+                    time_series.TimeSeries(
+                        [label_value.LabelValue(tag) for tag in tag_values],
+                        [point.Point(point_value, timestamp)],
+                        self._start_time,
+                    )
+                )
+
+            if not time_series_list:
+                continue
+
+            descriptor = metric_descriptor.MetricDescriptor(
+                name,
+                view.description,
+                view.measure.unit,
+                descriptor_type,
+                [label_key.LabelKey(column, "") for column in view.columns],
+            )
+            metrics.append(metric_module.Metric(descriptor, time_series_list))
+        return metrics
+
+    @staticmethod
+    def _distribution_value(snapshot, bounds):
+        count, sum_, buckets = snapshot
+        if not bounds:
+            if not count:
+                sum_ = 0
+            return value.ValueDistribution(count, sum_, 0, value.BucketOptions())
+
+        # A snapshot taken while a value is being added may not have updated
+        # every field. The bucket counts are authoritative.
+        count = sum(buckets)
+        if not count:
+            sum_ = 0
+        return value.ValueDistribution(
+            count,
+            sum_,
+            0,
+            value.BucketOptions(value.Explicit(list(bounds))),
+            [value.Bucket(bucket_count) for bucket_count in buckets],
+        )
@@ -0,0 +1,183 @@
+# Copyright 2019 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Replay a capture through the exporters against a local stub server
+
+Usage::
+
+    python -m opencensus_ext_newrelic.replay workload.nrcap --speed 10
+
+Data is sent to a local stand-in for the New Relic APIs, so no insert key or
+network access is required. A ``--speed`` of 0 replays as fast as possible.
+"""
+
+import argparse
+import functools
+import sys
+import time
+
+from newrelic_telemetry_sdk import MetricClient, SpanClient
+
+from opencensus_ext_newrelic._stub import StubServer
+from opencensus_ext_newrelic.capture import read_capture
+from opencensus_ext_newrelic.stats import NewRelicStatsExporter
+from opencensus_ext_newrelic.trace import DefaultTransport, NewRelicTraceExporter
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # pragma: no cover
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None  # pragma: no cover
+
+
+class ReplayResult(object):
+    """The outcome of a replay"""
+
+    def __init__(self):
+        self.spans = self.metrics = self.requests = self.bytes_sent = 0
+        self.elapsed = 0.0
+        self.peak_memory = None
+
+    def report(self, out=None):
+        """Write a summary of the replay to ``out`` (default: stdout)"""
+        out = out or sys.stdout
+        elapsed = self.elapsed or float("nan")
+        lines = [
+            "elapsed:      {:.3f}s".format(self.elapsed),
+            "spans:        {} ({:.0f}/s)".format(self.spans, self.spans / elapsed),
+            "metrics:      {} ({:.0f}/s)".format(self.metrics, self.metrics / elapsed),
+            "requests:     {}".format(self.requests),
+            "bytes sent:   {}".format(self.bytes_sent),
+        ]
+        if self.peak_memory is not None:
+            lines.append("peak memory:  {:.1f} KiB".format(self.peak_memory / 1024.0))
+        if resource is not None:
+            lines.append(
+                "max RSS:      {} KiB".format(
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                )
+            )
+        out.write("\n".join(lines) + "\n")
+
+
+def replay(path, speed=1.0, latency=0.0, wait_period=5.0, trace_memory=False):
+    """Replay a capture file through the trace and stats exporters
+
+    :param path: The path of the capture file.
+    :type path: str
+    :param speed: (optional) The replay speed relative to the original
+        workload. 0 replays as fast as possible. Default is 1.
+    :type speed: float
+    :param latency: (optional) The response latency of the stub server in
+        seconds.
+    :type latency: float
+    :param wait_period: (optional) The wait period of the trace transport.
+    :type wait_period: float
+    :param trace_memory: (optional) Measure the peak memory allocated during
+        the replay with :mod:`tracemalloc`.
+    :type trace_memory: bool
+    :rtype: :class:`ReplayResult`
+    """
+    result = ReplayResult()
+    with StubServer(latency=latency) as server:
+        trace_exporter = NewRelicTraceExporter(
+            "stub-insert-key",
+            service_name="Replay",
+            transport=functools.partial(DefaultTransport, wait_period=wait_period),
+        )
+        trace_exporter.client = server.client(SpanClient)
+
+        stats_exporter = NewRelicStatsExporter("stub-insert-key", service_name="Replay")
+        stats_exporter._thread.cancel()
+        stats_exporter.client = server.client(MetricClient)
+
+        if trace_memory and tracemalloc is not None:
+            tracemalloc.start()
+
+        start = time.time()
+        for kind, offset, payload in read_capture(path):
+            if speed:
+                delay = start + offset / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if kind == "s":
+                trace_exporter.export(payload)
+                result.spans += len(payload)
+            elif kind == "m":
+                stats_exporter.export_metrics(payload)
+                result.metrics += sum(len(metric.time_series) for metric in payload)
+            elif kind == "v":
+                stats_exporter.on_register_view(payload)
+
+        trace_exporter.stop()
+        result.elapsed = time.time() - start
+
+        if trace_memory and tracemalloc is not None:
+            result.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        result.requests = server.requests
+        result.bytes_sent = server.bytes_received
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m opencensus_ext_newrelic.replay",
+        description=__doc__.splitlines()[0],
+    )
+    parser.add_argument("capture", help="capture file written by a Recorder")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="replay speed multiplier, 0 for as fast as possible (default: 1)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="stub server response latency in seconds (default: 0)",
+    )
+    parser.add_argument(
+        "--wait-period",
+        type=float,
+        default=5.0,
+        help="trace transport wait period in seconds (default: 5)",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="report the peak memory allocated during the replay",
+    )
+    args = parser.parse_args(argv)
+
+    result = replay(
+        args.capture,
+        speed=args.speed,
+        latency=args.latency,
+        wait_period=args.wait_period,
+        trace_memory=args.trace_memory,
+    )
+    result.report()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
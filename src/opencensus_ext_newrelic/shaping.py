@@ -0,0 +1,170 @@
+# Copyright 2019 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Limit the bandwidth and request rate used by the exporters"""
+
+import threading
+import time
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic  # pragma: no cover
+
+
+class TokenBucket(object):
+    """Tokens added at a constant rate, up to a maximum
+
+    Tokens are reserved ahead of time: a reservation larger than the tokens
+    available is granted once the bucket has refilled the difference, so
+    amounts larger than the capacity are delayed rather than refused.
+
+    :param rate: The number of tokens added every second.
+    :type rate: int or float
+    :param capacity: The maximum number of tokens, allowing bursts of up to
+        ``capacity`` without waiting.
+    :type capacity: int or float
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = monotonic()
+
+    def delay(self, amount, now):
+        """Return the seconds to wait before ``amount`` tokens are available
+
+        :param amount: The number of tokens required.
+        :type amount: int or float
+        :param now: The current :func:`time.monotonic` time.
+        :type now: float
+        :rtype: float
+        """
+        tokens = min(self._tokens + (now - self._updated) * self.rate, self.capacity)
+        self._tokens = tokens
+        self._updated = now
+        return max(amount - tokens, 0) / self.rate
+
+    def take(self, amount):
+        """Remove tokens, possibly leaving the bucket in debt
+
+        Call :meth:`delay` first to refill the bucket.
+        """
+        self._tokens -= amount
+
+
+class Shaper(object):
+    """Pace requests to stay below a bandwidth and request rate
+
+    :meth:`acquire` blocks the sending thread until the request fits both
+    limits. Telemetry is then delayed instead of dropped, and keeps
+    accumulating in the exporter's buffers while the sender waits.
+
+    A single shaper may be shared by the trace and stats exporters so that
+    their combined traffic stays within the limits.
+
+    :param bytes_per_second: (optional) The maximum average number of payload
+        bytes sent every second. Defaults to no limit.
+    :type bytes_per_second: int or float
+    :param requests_per_second: (optional) The maximum average number of
+        requests sent every second. Defaults to no limit.
+    :type requests_per_second: int or float
+    :param burst: (optional) The number of seconds of traffic that may be sent
+        at once after a quiet period. Default is 1 second.
+    :type burst: int or float
+
+    :ivar requests: The number of requests allowed through
+    :ivar bytes: The number of payload bytes allowed through
+    :ivar throttled: The number of requests that had to wait
+    :ivar throttled_seconds: The total time requests spent waiting
+
+    Usage::
+
+        >>> shaper = Shaper(bytes_per_second=1000, requests_per_second=10)
+        >>> shaper.acquire(500)
+        True
+        >>> shaper.counters["throttled"]
+        0
+    """
+
+    def __init__(self, bytes_per_second=None, requests_per_second=None, burst=1.0):
+        self._buckets = []
+        self._bytes = self._requests = None
+        if bytes_per_second:
+            self._bytes = TokenBucket(bytes_per_second, bytes_per_second * burst)
+            self._buckets.append(self._bytes)
+        if requests_per_second:
+            self._requests = TokenBucket(
+                requests_per_second, max(requests_per_second * burst, 1)
+            )
+            self._buckets.append(self._requests)
+
+        self._lock = threading.Lock()
+        self.requests = self.bytes = self.throttled = 0
+        self.throttled_seconds = 0.0
+
+    @property
+    def counters(self):
+        """A dict of the request, byte and throttling counters"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "bytes": self.bytes,
+                "throttled": self.throttled,
+                "throttled_seconds": self.throttled_seconds,
+            }
+
+    def acquire(self, size, deadline=None):
+        """Wait until a request of ``size`` bytes may be sent
+
+        Requests are granted in the order they call :meth:`acquire`. A request
+        that cannot be sent before ``deadline`` returns immediately without
+        using up any of the limits.
+
+        :param size: The size of the request body in bytes.
+        :type size: int
+        :param deadline: (optional) The :func:`time.monotonic` time by which
+            the request must be sent. Defaults to waiting as long as needed.
+        :type deadline: float
+        :returns: True if the request may be sent, False if the deadline would
+            be exceeded.
+        :rtype: bool
+        """
+        with self._lock:
+            now = monotonic()
+            amounts = []
+            wait = 0.0
+            for bucket in self._buckets:
+                amount = size if bucket is self._bytes else 1
+                amounts.append(amount)
+                wait = max(wait, bucket.delay(amount, now))
+
+            if deadline is not None and now + wait > deadline:
+                return False
+
+            for bucket, amount in zip(self._buckets, amounts):
+                bucket.take(amount)
+
+            self.requests += 1
+            self.bytes += size
+            if wait:
+                self.throttled += 1
+                self.throttled_seconds += wait
+
+        # Tokens are reserved before waiting so concurrent senders queue up
+        # behind this request instead of racing for the same tokens
+        if wait:
+            time.sleep(wait)
+        return True
@@ -13,28 +13,51 @@
 # limitations under the License.
 
 import calendar
+import collections
+import copy
+import itertools
 from opencensus.stats import stats
 from opencensus.metrics import transport
 from opencensus.stats import aggregation
+from opencensus.stats import measure
 from newrelic_telemetry_sdk import (
-    MetricBatch,
     MetricClient,
     GaugeMetric,
     CountMetric,
     SummaryMetric,
 )
+from opencensus_ext_newrelic._client import (
+    Fanout,
+    LazyClient,
+    client_factory,
+    encode_batch,
+    hoist_common_attributes,
+    send_payload,
+)
+from opencensus_ext_newrelic._delta import DeltaState
+from opencensus_ext_newrelic.circuit import CircuitBreaker
+from opencensus_ext_newrelic.lifecycle import deadline, remaining
 
 import logging
-
-try:
-    from opencensus_ext_newrelic.version import version as __version__
-except ImportError:  # pragma: no cover
-    __version__ = "unknown"  # pragma: no cover
+import threading
 
 _logger = logging.getLogger(__name__)
 COUNT_AGGREGATION_TYPES = {aggregation.CountAggregation, aggregation.SumAggregation}
 
 
+class _ProducerChain(object):
+    # A metric producer returning the metrics of a list of producers, so that
+    # producers added later are collected by the exporter thread
+
+    def __init__(self, producers):
+        self.producers = producers
+
+    def get_metrics(self):
+        return itertools.chain.from_iterable(
+            producer.get_metrics() for producer in self.producers
+        )
+
+
 class NewRelicStatsExporter(object):
     """Export Metric data to the New Relic platform
 
@@ -50,6 +73,51 @@ class NewRelicStatsExporter(object):
     :type host: str
     :param port: (optional) Override the port for the API endpoint.
     :type port: int
+    :param circuit_breaker: (optional) A circuit breaker used to suspend
+        sends while the endpoint is failing. The same breaker may be shared
+        with a :class:`opencensus_ext_newrelic.NewRelicTraceExporter`.
+        Defaults to a new :class:`opencensus_ext_newrelic.CircuitBreaker`.
+    :type circuit_breaker: :class:`opencensus_ext_newrelic.CircuitBreaker`
+    :param skip_unchanged: (optional) Skip count and distribution series whose
+        cumulative value did not change since the last export instead of
+        reporting a zero delta. Views without any changed series are skipped
+        before their series are converted. Gauges are always reported.
+        Default is False.
+    :type skip_unchanged: bool
+    :param recorder: (optional) Record all metrics passed to
+        :meth:`export_metrics`.
+    :type recorder: :class:`opencensus_ext_newrelic.capture.Recorder`
+    :param destinations: (optional) Additional accounts or endpoints receiving
+        a copy of all metrics. Each destination is a dict with an
+        ``insert_key`` and optionally a ``host`` and ``port``. Metrics are
+        encoded once and sent to each destination from its own thread, with
+        separate retries and circuit breaker. While the primary circuit is
+        open, destinations keep receiving metrics and the primary is sent the
+        accumulated deltas once it recovers.
+    :type destinations: list
+    :param histogram: (optional) Also export the bucket counts of distribution
+        views. For each series, a ``<view name>.bucket`` count metric is sent
+        per bucket with an ``le`` attribute holding the bucket's upper bound.
+        Counts are cumulative across buckets, as expected by the NRQL
+        ``bucketPercentile`` function. Leading empty buckets are omitted.
+        Default is False.
+    :type histogram: bool
+    :param rollups: (optional) The columns to keep for each view, by view
+        name. Series of a view whose kept columns have the same values are
+        merged before deltas are computed, so other columns are not sent.
+        Rollups apply to count, sum and distribution views.
+    :type rollups: dict
+    :param common_attributes: (optional) Attributes of all metrics, for
+        example the host or environment, sent once per request.
+    :type common_attributes: dict
+    :param hoist_attributes: (optional) Send attributes that have the same
+        value in every metric of a request once per request. Default is False.
+    :type hoist_attributes: bool
+    :param shaper: (optional) Limits the bandwidth and request rate used to
+        send metrics, including to additional destinations. The same shaper
+        may be shared with a
+        :class:`opencensus_ext_newrelic.NewRelicTraceExporter`.
+    :type shaper: :class:`opencensus_ext_newrelic.Shaper`
 
     Usage::
 
@@ -61,23 +129,75 @@ class NewRelicStatsExporter(object):
         >>> stats_exporter.stop()
     """
 
-    def __init__(self, insert_key, service_name, interval=5, host=None, port=443):
-        client = self.client = MetricClient(insert_key=insert_key, host=host, port=port)
-        client.add_version_info("NewRelic-OpenCensus-Exporter", __version__)
+    #: The :class:`newrelic_telemetry_sdk.MetricClient` used to send metrics.
+    #: It is created on first use.
+    client = LazyClient()
+
+    def __init__(
+        self,
+        insert_key,
+        service_name,
+        interval=5,
+        host=None,
+        port=443,
+        circuit_breaker=None,
+        skip_unchanged=False,
+        recorder=None,
+        destinations=None,
+        histogram=False,
+        rollups=None,
+        common_attributes=None,
+        hoist_attributes=False,
+        shaper=None,
+    ):
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.skip_unchanged = skip_unchanged
+        self.histogram = histogram
+        self.rollups = dict(rollups or ())
+        self.hoist_attributes = hoist_attributes
+        self._rollup_indices = {}
+        self.recorder = recorder
+        self.shaper = shaper
+        self._client = None
+        self._client_factory = client_factory(MetricClient, insert_key, host, port)
+        self._fanout = (
+            Fanout(MetricClient, destinations, shaper) if destinations else None
+        )
         self.views = {}
         self.merged_values = {}
+        self._fanout_values = None
+        self._lock = threading.Lock()
+        self._deadline = None
 
         # Register an exporter thread for this exporter
-        thread = self._thread = transport.get_exporter_thread(
-            [stats.stats], self, interval=interval
-        )
+        self._metric_producers = [stats.stats]
+        thread = self._thread = self._schedule(interval)
         self.interval = thread.interval
 
+        attributes = dict(common_attributes or ())
+        attributes["service.name"] = service_name
         self._common = {
             "interval.ms": self.interval * 1000,
-            "attributes": {"service.name": service_name},
+            "attributes": attributes,
         }
 
+    def _schedule(self, interval):
+        # The exporter thread only holds a weak reference to the producer
+        self._producer_chain = _ProducerChain(self._metric_producers)
+        return transport.get_exporter_thread(
+            [self._producer_chain], self, interval=interval
+        )
+
+    def add_recorder(self, recorder):
+        """Export the metrics of a recorder every interval
+
+        :param recorder: The recorder to export.
+        :type recorder: :class:`opencensus_ext_newrelic.recording.MetricRecorder`
+        """
+        for view in recorder.views.values():
+            self.on_register_view(view)
+        self._metric_producers.append(recorder)
+
     def on_register_view(self, view):
         """Called when a view is registered with the view manager
 
@@ -87,6 +207,108 @@ class NewRelicStatsExporter(object):
         if self.views is not None:
             self.views[view.name] = view
 
+    @staticmethod
+    def _delta_state(view, summary, buckets=0):
+        if summary:
+            # Distribution count, sum and bucket counts. A decreasing count
+            # indicates a reset.
+            return DeltaState((int, float) + (int,) * buckets, reset_column=0)
+
+        # Sums of a float measure may decrease, so resets are only detected
+        # for count aggregations.
+        if type(view.aggregation) is aggregation.CountAggregation:
+            return DeltaState((int,), reset_column=0)
+        elif isinstance(view.measure, measure.MeasureInt):
+            return DeltaState((int,))
+        return DeltaState((float,))
+
+    def _rollup_columns(self, view):
+        # The indices of the columns of a view kept by its rollup rule
+        indices = self._rollup_indices.get(view.name)
+        if indices is None:
+            columns = list(view.columns)
+            indices = []
+            for column in self.rollups[view.name]:
+                if column in columns:
+                    indices.append(columns.index(column))
+                else:
+                    _logger.warning(
+                        "Rollup column %r is not a column of view %s.",
+                        column,
+                        view.name,
+                    )
+            indices = self._rollup_indices[view.name] = tuple(indices)
+        return indices
+
+    @staticmethod
+    def _rollup(series, keys, indices, summary):
+        merged = collections.OrderedDict()
+        for (timeseries, value), key in zip(series, keys):
+            key = tuple(key[i] for i in indices)
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = [timeseries, dict(value) if summary else value]
+            elif summary:
+                total = entry[1]
+                total["count"] += value["count"]
+                total["sum"] += value["sum"]
+                if "buckets" in total:
+                    total["buckets"] = tuple(
+                        a + b for a, b in zip(total["buckets"], value["buckets"])
+                    )
+            else:
+                entry[1] += value
+
+        return list(merged), [tuple(entry) for entry in merged.values()]
+
+    @staticmethod
+    def _signature(metric):
+        # The cumulative values of every series of a view. They only stay the
+        # same while nothing is recorded for the view.
+        signature = []
+        for timeseries in metric.time_series:
+            value = timeseries.points[0].value
+            if hasattr(value, "value"):
+                signature.append(value.value)
+            else:
+                signature.append(
+                    (getattr(value, "count", None), getattr(value, "sum", None))
+                )
+        return signature
+
+    def _bucket_bounds(self, metric):
+        # The upper bound of each bucket of a distribution metric exported as
+        # a histogram, formatted as the "le" attribute
+        if not self.histogram:
+            return ()
+
+        point = metric.time_series[0].points[0]
+        bucket_type = point.value.bucket_options.type_
+        if bucket_type is None or not point.value.buckets:
+            return ()
+        return tuple(str(float(bound)) for bound in bucket_type.bounds) + ("+Inf",)
+
+    @staticmethod
+    def _bucket_metrics(name, bounds, bucket_deltas, tags, end_time_ms):
+        # Counts are cumulative across buckets. Buckets below the lowest
+        # recorded value have a count of zero and are omitted.
+        bucket_name = name + ".bucket"
+        count = 0
+        for le, bucket_delta in zip(bounds, bucket_deltas):
+            count += bucket_delta
+            if not count:
+                continue
+
+            bucket_tags = tags.copy()
+            bucket_tags["le"] = le
+            yield CountMetric(
+                name=bucket_name,
+                value=count,
+                tags=bucket_tags,
+                end_time_ms=end_time_ms,
+                interval_ms=None,
+            )
+
     def export_metrics(self, metrics):
         """Immediately send all metric data to the monitoring backend.
 
@@ -94,7 +316,65 @@ class NewRelicStatsExporter(object):
             backend
         :type metrics: :class:`opencensus.metrics.export.metric.Metric`
         """
+        with self._lock:
+            return self._export(metrics)[0]
+
+    def _export(self, metrics):
+        # Returns the response and the number of series left unsent
+        if self.recorder is not None:
+            metrics = list(metrics)
+            self.recorder.record_metrics(metrics, self.views)
+
+        # While the circuit is open, skip the export entirely. The cumulative
+        # values are not merged so the next successful export reports the
+        # deltas accumulated during the outage. The probe of a half-open
+        # circuit is only taken once there is a request to send.
+        breaker = self.circuit_breaker
+        fanout = self._fanout
+        send = breaker.would_allow()
+        if not send and fanout is None:
+            _logger.debug("New Relic circuit breaker is open. Skipping export.")
+            return None, sum(len(metric.time_series) for metric in metrics)
+
+        if fanout is not None and (not send or self._fanout_values is not None):
+            return self._export_diverged(list(metrics), send, fanout)
+
+        nr_metrics, series, states = self._convert(metrics, self.merged_values)
+        return self._send_metrics(nr_metrics, series, states, send, fanout)[:2]
+
+    def _export_diverged(self, metrics, send, fanout):
+        # Additional destinations receive metrics even while the primary
+        # circuit is open. Their deltas are computed from a separate copy of
+        # the cumulative values, so the primary is still sent the deltas
+        # accumulated during the outage once its circuit closes.
+        fanout_values = self._fanout_values
+        if fanout_values is None:
+            fanout_values = self._fanout_values = copy.deepcopy(self.merged_values)
+
+        nr_metrics, series, states = self._convert(metrics, fanout_values)
+        self._send_metrics(nr_metrics, series, states, False, fanout)
+
+        if not send:
+            return None, sum(len(metric.time_series) for metric in metrics)
+
+        # The primary is sent the same cumulative values, after which both
+        # share a single copy again
+        nr_metrics, series, states = self._convert(metrics, self.merged_values)
+        response, unsent, sent = self._send_metrics(
+            nr_metrics, series, states, True, None
+        )
+        if sent:
+            self._fanout_values = None
+        return response, unsent
+
+    def _convert(self, metrics, merged_values):
+        # Convert metrics to New Relic metrics, computing the deltas of
+        # cumulative series from the values stored in merged_values. Returns
+        # the New Relic metrics, the number of series they represent and the
+        # delta states holding the values to commit once they are sent.
         nr_metrics = []
+        converted = 0
+        states = []
         for metric in metrics:
             descriptor = metric.descriptor
             name = descriptor.name
@@ -103,71 +383,115 @@ class NewRelicStatsExporter(object):
             measure_unit = view.measure.unit
             aggregation_type = view.aggregation
 
+            # Skip views whose cumulative values are all unchanged before
+            # any tags or deltas are computed for their series
+            cumulative = type(aggregation_type) in COUNT_AGGREGATION_TYPES
+            signature = None
+            if self.skip_unchanged and (
+                cumulative
+                or type(aggregation_type) is aggregation.DistributionAggregation
+            ):
+                signature = self._signature(metric)
+                state = merged_values.get(name)
+                if state is not None and state.signature == signature:
+                    continue
+
             tags = {"measure.name": measure_name, "measure.unit": measure_unit}
 
+            series = []
             for timeseries in metric.time_series:
                 value = timeseries.points[0].value
                 if hasattr(value, "value"):
                     value = value.value
                 elif hasattr(value, "count") and hasattr(value, "sum"):
+                    buckets = getattr(value, "buckets", None)
                     value = {"count": value.count, "sum": value.sum}
+                    if self.histogram and buckets:
+                        value["buckets"] = tuple(bucket.count for bucket in buckets)
                 else:
                     _logger.warning(
                         "Unable to send metric %s with value: %s", name, value
                     )
                     break
 
+                series.append((timeseries, value))
+
+            if not series:
+                continue
+
+            summary = isinstance(series[0][1], dict)
+            bounds = self._bucket_bounds(metric) if summary else ()
+
+            columns = view.columns
+            keys = [
+                tuple(lv.value for lv in timeseries.label_values)
+                for timeseries, _ in series
+            ]
+
+            # Merge series that only differ in the columns rolled up
+            if name in self.rollups and (summary or cumulative):
+                indices = self._rollup_columns(view)
+                columns = [columns[i] for i in indices]
+                keys, series = self._rollup(series, keys, indices, summary)
+
+            # Compute delta values for all series of the view based on the
+            # previous values. If one does not exist, the raw value is used.
+            if summary or cumulative:
+                state = merged_values.get(name)
+                if state is None:
+                    state = merged_values[name] = self._delta_state(
+                        view, summary, len(bounds)
+                    )
+
+                if summary:
+                    rows = [
+                        (value["count"], value["sum"]) + value.get("buckets", ())
+                        for _, value in series
+                    ]
+                else:
+                    rows = [(value,) for _, value in series]
+                deltas = state.compute(keys, rows)
+                states.append((state, signature))
+            else:
+                deltas = [None] * len(series)
+
+            for (timeseries, value), key, delta in zip(series, keys, deltas):
+                # Skip the conversion of cumulative series that were not
+                # updated since the last export.
+                if self.skip_unchanged and delta is not None and not any(delta):
+                    continue
+
                 timestamp = timeseries.points[0].timestamp
                 time_tuple = timestamp.utctimetuple()
                 epoch_time_secs = calendar.timegm(time_tuple)
                 epoch_time_mus = epoch_time_secs * 1e6 + timestamp.microsecond
                 end_time_ms = epoch_time_mus // 1000
 
-                labels = (
-                    (k, l.value) for k, l in zip(view.columns, timeseries.label_values)
-                )
-
                 _tags = tags.copy()
-                _tags.update(labels)
-
-                if isinstance(value, dict):
-                    identity = MetricBatch.create_identity(name, _tags, "summary")
-
-                    # compute a delta count based on the previous value. if one
-                    # does not exist, report the raw count value.
-                    if identity in self.merged_values:
-                        last = self.merged_values[identity]
-                        delta_count = value["count"] - last["count"]
-                        delta_sum = value["sum"] - last["sum"]
-                    else:
-                        delta_count = value["count"]
-                        delta_sum = value["sum"]
-
-                    self.merged_values[identity] = value
+                _tags.update(zip(columns, key))
 
+                if summary:
                     nr_metric = SummaryMetric(
                         name=name,
-                        count=delta_count,
-                        sum=delta_sum,
+                        count=delta[0],
+                        sum=delta[1],
                         min=None,
                         max=None,
                         tags=_tags,
                         end_time_ms=end_time_ms,
                         interval_ms=None,
                     )
-
-                elif type(aggregation_type) in COUNT_AGGREGATION_TYPES:
-                    identity = MetricBatch.create_identity(name, _tags, "count")
-
-                    # Compute a delta count based on the previous value. If one
-                    # does not exist, report the raw count value.
-                    delta = value - self.merged_values.get(identity, 0)
-                    self.merged_values[identity] = value
-                    value = delta
-
+                    if bounds:
+                        nr_metrics.extend(
+                            self._bucket_metrics(
+                                name, bounds, delta[2:], _tags, end_time_ms
+                            )
+                        )
+
+                elif cumulative:
                     nr_metric = CountMetric(
                         name=name,
-                        value=value,
+                        value=delta[0],
                         tags=_tags,
                         end_time_ms=end_time_ms,
                         interval_ms=None,
@@ -179,32 +503,156 @@ class NewRelicStatsExporter(object):
                     )
 
                 nr_metrics.append(nr_metric)
+                converted += 1
 
+        return nr_metrics, converted, states
+
+    def _send_metrics(self, nr_metrics, series, states, send, fanout):
+        # Returns the response, the number of series left unsent and whether
+        # the metrics were sent. The new cumulative values are only stored
+        # once the metrics are sent, so the deltas of metrics held back by the
+        # deadline or the shaper are reported by the next export.
         # Do not send an empty metrics payload
         if not nr_metrics:
-            return
+            self._commit(states)
+            return None, 0, True
+
+        response, sent = self._send(nr_metrics, send, fanout)
+        if sent:
+            self._commit(states)
+        if response is None or not response.ok:
+            return response, series, sent
+        return response, 0, sent
+
+    @staticmethod
+    def _commit(states):
+        for state, signature in states:
+            state.commit()
+            state.signature = signature
+
+    def _send(self, nr_metrics, send, fanout):
+        # Returns the response and whether the metrics left the exporter.
+        # Requests made while flushing must complete within the deadline.
+        timeout = remaining(self._deadline)
+        if timeout == 0:
+            _logger.debug(
+                "New Relic flush deadline exceeded. Not sending %d metrics.",
+                len(nr_metrics),
+            )
+            return None, False
+
+        common = self._common
+        if self.hoist_attributes:
+            common = hoist_common_attributes(nr_metrics, common)
 
+        breaker = self.circuit_breaker
+        shaper = self.shaper
         try:
-            response = self.client.send_batch(nr_metrics, common=self._common)
+            if fanout is None and shaper is None:
+                if not breaker.allow_request():
+                    return self._breaker_open(nr_metrics)
+                response = self.client.send_batch(
+                    nr_metrics, common=common, timeout=timeout
+                )
+            else:
+                payload = encode_batch(self.client, nr_metrics, common)
+                # The metrics are only published once they are sure to be
+                # sent, as the deltas of metrics held back are sent again later
+                if send and shaper is not None:
+                    if not shaper.acquire(len(payload), self._deadline):
+                        _logger.debug(
+                            "New Relic flush deadline exceeded while throttled. "
+                            "Not sending %d metrics.",
+                            len(nr_metrics),
+                        )
+                        return None, False
+                    timeout = remaining(self._deadline)
+                if send and not breaker.allow_request():
+                    return self._breaker_open(nr_metrics)
+                if fanout is not None:
+                    fanout.publish(payload)
+                if not send:
+                    return None, True
+                response = send_payload(self.client, payload, timeout=timeout)
         except Exception:
+            breaker.record_failure()
             _logger.exception("New Relic send_metrics failed with an exception.")
-            return
+            return None, True
 
+        breaker.record_response(response)
         if not response.ok:
             _logger.error(
                 "New Relic send_metrics failed with status code: %r", response.status
             )
-        return response
+        return response, True
+
+    @staticmethod
+    def _breaker_open(nr_metrics):
+        # Another request took the probe of the half-open circuit. Nothing is
+        # sent so that every destination is sent the deltas next time.
+        _logger.debug(
+            "New Relic circuit breaker is open. Not sending %d metrics.",
+            len(nr_metrics),
+        )
+        return None, False
 
-    def stop(self):
-        """Terminate the exporter background thread"""
+    def flush(self, timeout=None):
+        """Collect and send the current metrics from the calling thread
+
+        :param timeout: (optional) The number of seconds to wait for the
+            request to complete. Defaults to waiting indefinitely.
+        :type timeout: int or float
+        :returns: The number of metric series left unsent.
+        :rtype: int
+        """
+        if self._thread is None:
+            return 0
+
+        with self._lock:
+            self._deadline = deadline(timeout)
+            try:
+                metrics = itertools.chain.from_iterable(
+                    producer.get_metrics() for producer in self._metric_producers
+                )
+                return self._export(metrics)[1]
+            except Exception:
+                _logger.exception("New Relic failed to flush metrics.")
+                return 0
+            finally:
+                self._deadline = None
+
+    def shutdown(self, timeout=None):
+        """Send the current metrics and terminate the exporter
+
+        :param timeout: (optional) The number of seconds to wait for pending
+            metrics to be sent. Defaults to waiting indefinitely.
+        :type timeout: int or float
+        :returns: The number of metric series left unsent.
+        :rtype: int
+        """
         thread = self._thread
+        if thread is None:
+            return 0
 
         stop = getattr(thread, "stop", None) or getattr(thread, "cancel")
         stop()
 
         # Send all pending metrics
-        thread.function(*thread.args, **thread.kwargs)
+        end = deadline(timeout)
+        unsent = self.flush(timeout)
+        if self._fanout is not None:
+            self._fanout.stop(remaining(end))
+
+        if unsent:
+            _logger.warning(
+                "New Relic stats exporter shut down with %d metrics unsent.", unsent
+            )
 
         # Clear all internal state
         self._thread = self.client = self.views = self.count_values = None
+        self._fanout = self._fanout_values = None
+        return unsent
+
+    def stop(self):
+        """Terminate the exporter background thread"""
+        self.shutdown()
@@ -12,32 +12,556 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from opencensus.common.transports import async_
+from opencensus.common.transports import base
 from opencensus.common.utils import timestamp_to_microseconds
 from opencensus.trace import base_exporter
+from opencensus.trace import execution_context
 from newrelic_telemetry_sdk import Span, SpanClient
+from opencensus_ext_newrelic._client import (
+    Fanout,
+    LazyClient,
+    client_factory,
+    encode_batch,
+    grow_pool,
+    hoist_common_attributes,
+    send_payload,
+)
+from opencensus_ext_newrelic.circuit import CircuitBreaker
+from opencensus_ext_newrelic.lifecycle import deadline, remaining, run_parallel
 
+import atexit
+import collections
+import functools
 import logging
+import sys
+import threading
+
+_logger = logging.getLogger(__name__)
+
+#: Spans with a truthy value for this attribute are exported with priority
+PRIORITY_ATTRIBUTE = "newrelic.priority"
+
+#: Returned by :meth:`NewRelicTraceExporter.emit` when spans were not sent
+#: because the flush or shutdown deadline passed
+DEADLINE_EXCEEDED = object()
+
+# Span attributes set by the span itself, never moved to the common block
+_SPAN_INTRINSICS = ("name", "duration.ms", "parent.id")
 
 try:
-    from opencensus_ext_newrelic.version import version as __version__
-except ImportError:  # pragma: no cover
-    __version__ = "unknown"  # pragma: no cover
+    intern = sys.intern
+except AttributeError:  # pragma: no cover
+    intern = intern  # pragma: no cover
 
-_logger = logging.getLogger(__name__)
 
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+class AttributeLimits(object):
+    """Limits applied to span attributes before spans are queued
+
+    String values longer than ``max_value_length`` are truncated. Attributes
+    beyond ``max_attributes`` or beyond ``max_bytes`` (estimated from the
+    length of keys and values) are dropped. Attribute keys are interned so
+    queued spans share key strings.
+
+    :param max_attributes: (optional) The maximum number of attributes per
+        span. Default is 254.
+    :type max_attributes: int
+    :param max_value_length: (optional) The maximum length of a string value.
+        Default is 4095.
+    :type max_value_length: int
+    :param max_bytes: (optional) The maximum size of all attributes of a
+        span. Default is 65536.
+    :type max_bytes: int
+
+    :ivar truncated_values: The number of truncated values
+    :ivar truncated_chars: The number of characters removed from values
+    :ivar dropped_attributes: The number of dropped attributes
+    """
+
+    def __init__(self, max_attributes=254, max_value_length=4095, max_bytes=65536):
+        self.max_attributes = max_attributes
+        self.max_value_length = max_value_length
+        self.max_bytes = max_bytes
+        self.truncated_values = self.truncated_chars = self.dropped_attributes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def counters(self):
+        """A dict of the truncation counters"""
+        return {
+            "truncated_values": self.truncated_values,
+            "truncated_chars": self.truncated_chars,
+            "dropped_attributes": self.dropped_attributes,
+        }
+
+    def apply(self, attributes):
+        """Return a copy of attributes within the limits
+
+        :param attributes: The span attributes
+        :type attributes: dict
+        :rtype: dict
+        """
+        max_value_length = self.max_value_length
+        remaining = self.max_bytes
+        truncated_values = truncated_chars = 0
+
+        limited = {}
+        for key, value in attributes.items():
+            if len(limited) == self.max_attributes:
+                break
+
+            if type(key) is str:
+                key = intern(key)
+
+            if isinstance(value, string_types):
+                size = len(value)
+                if size > max_value_length:
+                    truncated_values += 1
+                    truncated_chars += size - max_value_length
+                    value = value[:max_value_length]
+                    size = max_value_length
+            else:
+                size = 8
+
+            remaining -= len(key) + size
+            if remaining < 0:
+                break
+
+            limited[key] = value
+
+        dropped = len(attributes) - len(limited)
+        if dropped or truncated_values:
+            with self._lock:
+                self.truncated_values += truncated_values
+                self.truncated_chars += truncated_chars
+                self.dropped_attributes += dropped
+
+        return limited
+
+
+class SpanRecord(object):
+    """A compact representation of a span waiting to be sent
+
+    Span names are interned and timestamps are stored as integer
+    milliseconds, so a queued span only holds its ids, name and attributes.
+    """
+
+    __slots__ = (
+        "name",
+        "guid",
+        "trace_id",
+        "parent_id",
+        "start_time_ms",
+        "duration_ms",
+        "tags",
+    )
 
-class DefaultTransport(async_.AsyncTransport):
     def __init__(
-        self, exporter, grace_period=None, max_batch_size=600, wait_period=5.0
+        self, name, guid, trace_id, parent_id, start_time_ms, duration_ms, tags
     ):
-        super(DefaultTransport, self).__init__(
-            exporter, grace_period, max_batch_size, wait_period
+        self.name = name
+        self.guid = guid
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.start_time_ms = start_time_ms
+        self.duration_ms = duration_ms
+        self.tags = tags
+
+    @classmethod
+    def from_span_data(cls, span_data, attribute_limits=None):
+        """Create a record from a :class:`opencensus.trace.span_data.SpanData`
+
+        :param span_data: The span to convert
+        :type span_data: :class:`opencensus.trace.span_data.SpanData`
+        :param attribute_limits: (optional) Limits applied to the attributes
+        :type attribute_limits: :class:`AttributeLimits`
+        """
+        start_timestamp_mus = timestamp_to_microseconds(span_data.start_time)
+        end_timestamp_mus = timestamp_to_microseconds(span_data.end_time)
+        duration_mus = end_timestamp_mus - start_timestamp_mus
+
+        name = span_data.name
+        if type(name) is str:
+            name = intern(name)
+
+        attributes = span_data.attributes
+        if attributes and attribute_limits is not None:
+            attributes = attribute_limits.apply(attributes)
+
+        return cls(
+            name,
+            span_data.span_id,
+            span_data.context.trace_id,
+            span_data.parent_span_id,
+            start_timestamp_mus // 1000,
+            duration_mus // 1000,
+            attributes or None,
         )
 
-    def stop(self):
-        """Terminate the background thread"""
-        self.worker._export_pending_data()
+
+class Lane(object):
+    """A bounded queue of spans waiting to be emitted
+
+    When the lane is full, the oldest spans are evicted.
+
+    :ivar enqueued: The number of spans added to the lane
+    :ivar dropped: The number of spans evicted from the lane
+    :ivar exported: The number of spans handed to the exporter
+    """
+
+    def __init__(self, name, max_size):
+        self.name = name
+        self.max_size = max_size
+        self.enqueued = self.dropped = self.exported = 0
+        self._items = collections.deque()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, items):
+        items_ = self._items
+        items_.extend(items)
+        self.enqueued += len(items)
+
+        overflow = len(items_) - self.max_size
+        if overflow > 0:
+            for _ in range(overflow):
+                items_.popleft()
+            self.dropped += overflow
+
+    def take(self, count):
+        items_ = self._items
+        count = min(count, len(items_))
+        taken = [items_.popleft() for _ in range(count)]
+        self.exported += count
+        return taken
+
+    def restore(self, items):
+        """Return taken items to the front of the lane"""
+        items_ = self._items
+        items_.extendleft(reversed(items))
+        self.exported -= len(items)
+
+        overflow = len(items_) - self.max_size
+        if overflow > 0:
+            for _ in range(overflow):
+                items_.popleft()
+            self.dropped += overflow
+
+    @property
+    def counters(self):
+        """A dict of the lane counters and the number of pending spans"""
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "exported": self.exported,
+            "pending": len(self._items),
+        }
+
+
+class DefaultTransport(base.Transport):
+    """Asynchronous transport emitting spans from a background thread
+
+    Spans are queued in two lanes. Spans passed to :meth:`export_priority` go
+    to the priority lane, which is emitted first, and all other spans go to
+    the bulk lane. Each lane is bounded separately so bulk spans never evict
+    priority spans.
+
+    :param exporter: The exporter used to emit spans.
+    :type exporter: :class:`NewRelicTraceExporter`
+    :param grace_period: (optional) The default number of seconds to wait for
+        pending spans to be sent in :meth:`stop`. Defaults to waiting
+        indefinitely.
+    :type grace_period: int or float
+    :param max_batch_size: (optional) The maximum number of spans per
+        request. Default is 600.
+    :type max_batch_size: int
+    :param wait_period: (optional) The number of seconds to wait between
+        sends. Default is 5 seconds.
+    :type wait_period: int or float
+    :param max_queue_size: (optional) The maximum number of pending spans in
+        the bulk lane. Default is 10000.
+    :type max_queue_size: int
+    :param max_priority_queue_size: (optional) The maximum number of pending
+        spans in the priority lane. Default is 10000.
+    :type max_priority_queue_size: int
+    """
+
+    def __init__(
+        self,
+        exporter,
+        grace_period=None,
+        max_batch_size=600,
+        wait_period=5.0,
+        max_queue_size=10000,
+        max_priority_queue_size=10000,
+    ):
+        self.exporter = exporter
+        self.grace_period = grace_period
+        self.max_batch_size = max_batch_size
+        self.wait_period = wait_period
+        self.priority_lane = Lane("priority", max_priority_queue_size)
+        self.bulk_lane = Lane("bulk", max_queue_size)
+
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._stopped = False
+        self._deadline = None
+        self._in_flight = 0
+        self._start()
+
+    def _start(self):
+        self._thread = threading.Thread(
+            target=self._thread_main, name="NewRelicTraceExporter Worker"
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    @property
+    def counters(self):
+        """A dict of counters for each lane"""
+        with self._lock:
+            return {
+                lane.name: lane.counters
+                for lane in (self.priority_lane, self.bulk_lane)
+            }
+
+    @property
+    def unsent(self):
+        """The number of pending spans, including the batch being sent"""
+        with self._lock:
+            return len(self.priority_lane) + len(self.bulk_lane) + self._in_flight
+
+    def export(self, span_datas):
+        """Queue spans in the bulk lane"""
+        with self._lock:
+            self.bulk_lane.put(span_datas)
+
+    def export_priority(self, span_datas):
+        """Queue spans in the priority lane"""
+        with self._lock:
+            self.priority_lane.put(span_datas)
+
+    def _next_batch(self):
+        # Returns the priority and bulk spans of the next batch
+        with self._lock:
+            priority = self.priority_lane.take(self.max_batch_size)
+            bulk = self.bulk_lane.take(self.max_batch_size - len(priority))
+            self._in_flight += len(priority) + len(bulk)
+            return priority, bulk
+
+    def _export_pending(self, deadline=None):
+        while deadline is None or remaining(deadline):
+            priority, bulk = self._next_batch()
+            batch = priority + bulk
+            if not batch:
+                return
+
+            sent = True
+            try:
+                sent = self.exporter.emit(batch) is not DEADLINE_EXCEEDED
+            except Exception:
+                _logger.exception(
+                    "New Relic failed to emit spans. Dropping %d spans.", len(batch)
+                )
+            finally:
+                with self._lock:
+                    self._in_flight -= len(batch)
+
+                    # Spans not sent before the flush deadline stay queued
+                    # and are reported as unsent
+                    if not sent:
+                        self.priority_lane.restore(priority)
+                        self.bulk_lane.restore(bulk)
+
+            if not sent:
+                return
+
+    def _thread_main(self):
+        # Suppress tracking of requests made by this thread
+        execution_context.set_is_exporter(True)
+
+        while True:
+            self._event.wait(self.wait_period)
+            stopped = self._stopped
+            self._export_pending(self._deadline)
+            if stopped:
+                return
+
+    def flush(self, timeout=None):
+        """Send pending spans from the calling thread
+
+        Priority spans are sent first. No new batch is started once
+        ``timeout`` seconds have elapsed.
+
+        :param timeout: (optional) The number of seconds to spend sending.
+            Defaults to sending all pending spans.
+        :type timeout: int or float
+        :returns: The number of spans left unsent.
+        :rtype: int
+        """
+        self._export_pending(deadline(timeout))
+        return self.unsent
+
+    def _signal_stop(self, deadline=None):
+        with self._lock:
+            if self._stopped:
+                return False
+            self._stopped = True
+            self._deadline = deadline
+
+        self._event.set()
+        return True
+
+    def stop(self, timeout=None):
+        """Send pending spans and terminate the background thread
+
+        :param timeout: (optional) The number of seconds to wait for pending
+            spans to be sent. Defaults to ``grace_period``.
+        :type timeout: int or float
+        :returns: The number of spans left unsent.
+        :rtype: int
+        """
+        if timeout is None:
+            timeout = self.grace_period
+        if self._signal_stop(deadline(timeout)):
+            self._thread.join(timeout)
+        return self.unsent
+
+
+class ShardedTransport(base.Transport):
+    """Asynchronous transport emitting spans from several background threads
+
+    Spans are assigned to one of ``shards`` :class:`DefaultTransport` lanes by
+    trace id, so the spans of a trace are batched together. Each shard
+    batches, converts and sends its spans independently. The connection pool
+    of the exporter's client keeps a connection for each shard.
+
+    Usage::
+
+        >>> import functools
+        >>> transport = functools.partial(ShardedTransport, shards=8)
+
+    :param exporter: The exporter used to emit spans.
+    :type exporter: :class:`NewRelicTraceExporter`
+    :param shards: (optional) The number of worker threads. Default is 4.
+    :type shards: int
+    :param grace_period: (optional) The number of seconds to wait for all
+        shards to send pending spans in :meth:`stop`. Defaults to waiting
+        indefinitely.
+    :type grace_period: int or float
+
+    All other keyword arguments are passed to each :class:`DefaultTransport`.
+    """
+
+    def __init__(self, exporter, shards=4, grace_period=None, **kwargs):
+        self.exporter = exporter
+        self.grace_period = grace_period
+        self.shards = tuple(
+            DefaultTransport(exporter, grace_period=grace_period, **kwargs)
+            for _ in range(shards)
+        )
+        for i, shard in enumerate(self.shards):
+            shard._thread.name = "NewRelicTraceExporter Worker-{}".format(i)
+
+        self._pool_lock = threading.Lock()
+        self._pool_grown = False
+
+        # Registered after the shards so that it runs before their handlers
+        atexit.register(self.stop)
+
+    @property
+    def counters(self):
+        """A dict of counters for each lane, summed across shards"""
+        counters = {}
+        for shard in self.shards:
+            for lane, lane_counters in shard.counters.items():
+                totals = counters.setdefault(lane, dict.fromkeys(lane_counters, 0))
+                for name, value in lane_counters.items():
+                    totals[name] += value
+        return counters
+
+    def _partition(self, span_datas):
+        shards = self.shards
+        if len(shards) == 1:
+            return ((shards[0], span_datas),)
+
+        partitions = {}
+        for span_data in span_datas:
+            index = hash(span_data.trace_id) % len(shards)
+            partitions.setdefault(index, []).append(span_data)
+        return ((shards[index], spans) for index, spans in partitions.items())
+
+    def _grow_pool(self):
+        # The client is created lazily and may be replaced after the
+        # transport is created, so the pool is grown once the first spans
+        # are queued and before any shard sends them
+        with self._pool_lock:
+            if not self._pool_grown:
+                self._pool_grown = True
+                client = self.exporter.client
+                if client is not None:
+                    grow_pool(client, len(self.shards))
+
+    def export(self, span_datas):
+        """Queue spans in the bulk lane of their shard"""
+        if not self._pool_grown:
+            self._grow_pool()
+        for shard, spans in self._partition(span_datas):
+            shard.export(spans)
+
+    def export_priority(self, span_datas):
+        """Queue spans in the priority lane of their shard"""
+        if not self._pool_grown:
+            self._grow_pool()
+        for shard, spans in self._partition(span_datas):
+            shard.export_priority(spans)
+
+    @property
+    def unsent(self):
+        """The number of pending spans of all shards"""
+        return sum(shard.unsent for shard in self.shards)
+
+    def flush(self, timeout=None):
+        """Send pending spans of every shard in parallel
+
+        :param timeout: (optional) The number of seconds to spend sending.
+            Defaults to sending all pending spans.
+        :type timeout: int or float
+        :returns: The number of spans left unsent.
+        :rtype: int
+        """
+        run_parallel(
+            [functools.partial(shard.flush, timeout) for shard in self.shards],
+            timeout,
+        )
+        return self.unsent
+
+    def stop(self, timeout=None):
+        """Send pending spans and terminate all background threads
+
+        All shards are signalled at once and drain in parallel. The timeout
+        applies to the shards as a whole.
+
+        :param timeout: (optional) The number of seconds to wait for pending
+            spans to be sent. Defaults to ``grace_period``.
+        :type timeout: int or float
+        :returns: The number of spans left unsent.
+        :rtype: int
+        """
+        if timeout is None:
+            timeout = self.grace_period
+        end = deadline(timeout)
+        stopping = [shard for shard in self.shards if shard._signal_stop(end)]
+        for shard in stopping:
+            shard._thread.join(remaining(end))
+        return self.unsent
 
 
 class NewRelicTraceExporter(base_exporter.Exporter):
@@ -55,13 +579,43 @@ class NewRelicTraceExporter(base_exporter.Exporter):
         should extend from the base_exporter
         :class:`opencensus.common.transports.base.Transport` type and implement
         :meth:`opencensus.common.transports.base.Transport.export`. Defaults to
-        an async transport sending data every 5 seconds. The other option is
+        :class:`DefaultTransport`, an async transport sending data every 5
+        seconds with a priority lane for error spans, root spans and spans
+        with a truthy :data:`PRIORITY_ATTRIBUTE`. The other option is
         :class:`opencensus.common.transports.async.AsyncTransport`.
     :type transport: :class:`opencensus.common.transports.base.Transport`
     :param host: (optional) Override the host for the API endpoint.
     :type host: str
     :param port: (optional) Override the port for the API endpoint.
     :type host: int
+    :param circuit_breaker: (optional) A circuit breaker used to suspend
+        sends while the endpoint is failing. The same breaker may be shared
+        with a :class:`opencensus_ext_newrelic.NewRelicStatsExporter`.
+        Defaults to a new :class:`opencensus_ext_newrelic.CircuitBreaker`.
+    :type circuit_breaker: :class:`opencensus_ext_newrelic.CircuitBreaker`
+    :param recorder: (optional) Record all spans passed to :meth:`export`.
+    :type recorder: :class:`opencensus_ext_newrelic.capture.Recorder`
+    :param destinations: (optional) Additional accounts or endpoints receiving
+        a copy of all spans. Each destination is a dict with an ``insert_key``
+        and optionally a ``host`` and ``port``. Spans are encoded once and
+        sent to each destination from its own thread, with separate retries
+        and circuit breaker.
+    :type destinations: list
+    :param attribute_limits: (optional) Limits on the number and size of span
+        attributes. Defaults to a new :class:`AttributeLimits`. Pass False to
+        send attributes unchanged.
+    :type attribute_limits: :class:`AttributeLimits`
+    :param common_attributes: (optional) Attributes of all spans, for example
+        the host or environment, sent once per request.
+    :type common_attributes: dict
+    :param hoist_attributes: (optional) Send attributes that have the same
+        value in every span of a request once per request. Default is False.
+    :type hoist_attributes: bool
+    :param shaper: (optional) Limits the bandwidth and request rate used to
+        send spans, including to additional destinations. Batches wait for
+        the shaper while new spans keep being buffered. The same shaper may
+        be shared with a :class:`opencensus_ext_newrelic.NewRelicStatsExporter`.
+    :type shaper: :class:`opencensus_ext_newrelic.Shaper`
 
     Usage::
 
@@ -73,48 +627,133 @@ class NewRelicTraceExporter(base_exporter.Exporter):
         >>> trace_exporter.stop()
     """
 
+    #: The :class:`newrelic_telemetry_sdk.SpanClient` used to send spans. It
+    #: is created on first use.
+    client = LazyClient()
+
     def __init__(
-        self, insert_key, service_name, transport=DefaultTransport, host=None, port=443
+        self,
+        insert_key,
+        service_name,
+        transport=DefaultTransport,
+        host=None,
+        port=443,
+        circuit_breaker=None,
+        recorder=None,
+        destinations=None,
+        attribute_limits=None,
+        common_attributes=None,
+        hoist_attributes=False,
+        shaper=None,
     ):
-        self._common = {"attributes": {"service.name": service_name}}
-        client = self.client = SpanClient(insert_key=insert_key, host=host, port=port)
-        client.add_version_info("NewRelic-OpenCensus-Exporter", __version__)
+        attributes = dict(common_attributes or ())
+        attributes["service.name"] = service_name
+        self._common = {"attributes": attributes}
+        self.hoist_attributes = hoist_attributes
+        if attribute_limits is None:
+            attribute_limits = AttributeLimits()
+        self.attribute_limits = attribute_limits or None
+        self._deadline = None
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.recorder = recorder
+        self.shaper = shaper
+        self._client = None
+        self._client_factory = client_factory(SpanClient, insert_key, host, port)
+        self._fanout = (
+            Fanout(SpanClient, destinations, shaper) if destinations else None
+        )
         self._transport = transport(self)
 
     def emit(self, span_datas):
         """Immediately marshal span data to the tracing backend
 
         :param span_datas: list of :class:`opencensus.trace.span_data.SpanData`
-            to emit
+            or :class:`SpanRecord` to emit
         :type span_datas: list
+        :returns: The response, None if the spans could not be sent, or
+            :data:`DEADLINE_EXCEEDED` if the flush deadline passed before
+            they were sent.
         """
+        # Additional destinations receive spans even while the circuit of the
+        # primary destination is open. The probe of a half-open circuit is
+        # only taken immediately before the request is sent.
+        breaker = self.circuit_breaker
+        fanout = self._fanout
+        send = breaker.would_allow()
+        if not send and fanout is None:
+            _logger.debug(
+                "New Relic circuit breaker is open. Dropping %d spans.",
+                len(span_datas),
+            )
+            return
+
+        # Requests made while flushing must complete within the deadline
+        timeout = remaining(self._deadline)
+        if timeout == 0:
+            _logger.debug(
+                "New Relic flush deadline exceeded. Not sending %d spans.",
+                len(span_datas),
+            )
+            return DEADLINE_EXCEEDED
+
+        attribute_limits = self.attribute_limits
         spans = []
         for span_data in span_datas:
-            start_timestamp_mus = timestamp_to_microseconds(span_data.start_time)
-            end_timestamp_mus = timestamp_to_microseconds(span_data.end_time)
-            duration_mus = end_timestamp_mus - start_timestamp_mus
-
-            start_time_ms = start_timestamp_mus // 1000
-            duration_ms = duration_mus // 1000
+            if type(span_data) is not SpanRecord:
+                span_data = SpanRecord.from_span_data(span_data, attribute_limits)
 
             span = Span(
                 name=span_data.name,
-                tags=span_data.attributes,
-                guid=span_data.span_id,
-                trace_id=span_data.context.trace_id,
-                parent_id=span_data.parent_span_id,
-                start_time_ms=start_time_ms,
-                duration_ms=duration_ms,
+                tags=span_data.tags,
+                guid=span_data.guid,
+                trace_id=span_data.trace_id,
+                parent_id=span_data.parent_id,
+                start_time_ms=span_data.start_time_ms,
+                duration_ms=span_data.duration_ms,
             )
 
             spans.append(span)
 
+        common = self._common
+        if self.hoist_attributes:
+            common = hoist_common_attributes(spans, common, _SPAN_INTRINSICS)
+
+        shaper = self.shaper
         try:
-            response = self.client.send_batch(spans, self._common)
+            if fanout is None and shaper is None:
+                send = breaker.allow_request()
+                if send:
+                    response = self.client.send_batch(spans, common, timeout=timeout)
+            else:
+                payload = encode_batch(self.client, spans, common)
+                # The batch is only published once it is sure to be sent, as
+                # batches held back at the deadline are sent again later
+                if send and shaper is not None:
+                    if not shaper.acquire(len(payload), self._deadline):
+                        _logger.debug(
+                            "New Relic flush deadline exceeded while throttled. "
+                            "Not sending %d spans.",
+                            len(spans),
+                        )
+                        return DEADLINE_EXCEEDED
+                    timeout = remaining(self._deadline)
+                send = send and breaker.allow_request()
+                if fanout is not None:
+                    fanout.publish(payload)
+                if send:
+                    response = send_payload(self.client, payload, timeout=timeout)
         except Exception:
+            breaker.record_failure()
             _logger.exception("New Relic send_spans failed with an exception.")
             return
 
+        if not send:
+            _logger.debug(
+                "New Relic circuit breaker is open. Dropping %d spans.", len(spans)
+            )
+            return
+
+        breaker.record_response(response)
         if not response.ok:
             _logger.error(
                 "New Relic send_spans failed with status code: %r", response.status
@@ -131,16 +770,105 @@ class NewRelicTraceExporter(base_exporter.Exporter):
             to export.
         :type span_datas: list
         """
-        if self._transport is not None:
-            return self._transport.export(span_datas)
+        transport = self._transport
+        if transport is None:
+            return
 
-    def stop(self):
-        """Terminate the exporter and any background threads"""
+        if self.recorder is not None:
+            self.recorder.record_spans(span_datas)
+
+        # Transports supporting priority receive error, root and flagged
+        # spans separately so they are sent first and evicted last.
+        export_priority = getattr(transport, "export_priority", None)
+        if export_priority is None:
+            return transport.export(span_datas)
+
+        # Spans are queued as compact records, converted on this thread
+        attribute_limits = self.attribute_limits
+        priority, bulk = [], []
+        for span_data in span_datas:
+            record = SpanRecord.from_span_data(span_data, attribute_limits)
+            if self._is_priority(span_data):
+                priority.append(record)
+            else:
+                bulk.append(record)
+
+        if priority:
+            export_priority(priority)
+        if bulk:
+            transport.export(bulk)
+
+    @staticmethod
+    def _is_priority(span_data):
+        status = span_data.status
+        if status is not None and status.code:
+            return True
+
+        if span_data.parent_span_id is None:
+            return True
+
+        attributes = span_data.attributes
+        return bool(attributes and attributes.get(PRIORITY_ATTRIBUTE))
+
+    def flush(self, timeout=None):
+        """Send pending spans from the calling thread
+
+        Error, root and flagged spans are sent before other spans. No new
+        request is started once ``timeout`` seconds have elapsed.
+
+        :param timeout: (optional) The number of seconds to spend sending.
+            Defaults to sending all pending spans.
+        :type timeout: int or float
+        :returns: The number of spans left unsent.
+        :rtype: int
+        """
+        transport = self._transport
+        if transport is None:
+            return 0
+
+        # Only the transports queueing priority spans support a timeout
+        if getattr(transport, "export_priority", None) is None:
+            transport.flush()
+            return 0
+
+        self._deadline = deadline(timeout)
+        try:
+            return transport.flush(timeout)
+        finally:
+            self._deadline = None
+
+    def shutdown(self, timeout=None):
+        """Send pending spans and terminate the exporter
+
+        :param timeout: (optional) The number of seconds to wait for pending
+            spans to be sent. Defaults to the grace period of the transport.
+        :type timeout: int or float
+        :returns: The number of spans left unsent.
+        :rtype: int
+        """
         transport = self._transport
+        if transport is None:
+            return 0
 
         # Send all pending data
-        if hasattr(transport, "stop"):
+        end = self._deadline = deadline(timeout)
+        unsent = 0
+        if getattr(transport, "export_priority", None) is not None:
+            unsent = transport.stop(timeout)
+        elif hasattr(transport, "stop"):
             transport.stop()
+        if self._fanout is not None:
+            self._fanout.stop(remaining(end))
+
+        if unsent:
+            _logger.warning(
+                "New Relic trace exporter shut down with %d spans unsent.", unsent
+            )
 
         # Clear all internal state
-        self._transport = self.client = None
+        self._transport = self.client = self._fanout = None
+        return unsent
+
+    def stop(self):
+        """Terminate the exporter and any background threads"""
+        self.shutdown()
@@ -1,8 +1,21 @@
 import os
 import functools
 import pytest
+import time
 import zlib
+from datetime import datetime, timedelta
 from newrelic_telemetry_sdk.client import HTTPResponse
+from opencensus.common.transports import sync
+from opencensus.stats import aggregation as aggregation_module
+from opencensus.stats import measure as measure_module
+from opencensus.stats import metric_utils
+from opencensus.stats import view as view_module
+from opencensus.stats import view_data as view_data_module
+from opencensus.tags import tag_map as tag_map_module
+from opencensus.trace import span_context
+from opencensus.trace import status as status_module
+from opencensus.trace.span_data import SpanData
+from opencensus_ext_newrelic import NewRelicStatsExporter
 from urllib3 import HTTPConnectionPool
 
 try:
@@ -113,3 +126,129 @@ def mocked_responses(request, monkeypatch):
         "urlopen",
         _capture_request(wrapped, status_code, disable_requests),
     )
+
+
+# The latency in milliseconds
+MEASURE = measure_module.MeasureFloat("number", "A number!", "things")
+
+GAUGE_VIEWS = {
+    "last": view_module.View(
+        "last",
+        "A last value",
+        ("tag",),
+        MEASURE,
+        aggregation_module.LastValueAggregation(),
+    )
+}
+COUNT_VIEWS = {
+    "count": view_module.View(
+        "count", "A count", ("tag",), MEASURE, aggregation_module.CountAggregation()
+    ),
+    "sum": view_module.View(
+        "sum", "A sum", ("tag",), MEASURE, aggregation_module.SumAggregation()
+    ),
+}
+DISTRIBUTION_VIEWS = {
+    "distribution": view_module.View(
+        "distribution",
+        "A distribution",
+        ("tag",),
+        MEASURE,
+        aggregation_module.DistributionAggregation([50.0, 200.0]),
+    )
+}
+VIEWS = {}
+VIEWS.update(GAUGE_VIEWS)
+VIEWS.update(COUNT_VIEWS)
+VIEWS.update(DISTRIBUTION_VIEWS)
+
+METRIC_TIME = time.time()
+EXPECTED_TIMESTAMP = int(METRIC_TIME * 1000.0)
+TEST_TIMESTAMP = datetime.utcfromtimestamp(METRIC_TIME)
+
+
+def record_values(view_data_objects, tags, value=1, count=1):
+    tag_map = tag_map_module.TagMap(tags)
+    for view_data_object in view_data_objects:
+        for _ in range(count):
+            # Timestamp here is only used to record exemplars. It is safe to
+            # leave it as None
+            view_data_object.record(tag_map, value, None)
+
+
+def generate_metrics(view_data_objects):
+    metrics = []
+    for view_data_object in view_data_objects:
+        metric = metric_utils.view_data_to_metric(view_data_object, TEST_TIMESTAMP)
+        metrics.append(metric)
+    return metrics
+
+
+def to_view_data(view):
+    # Start and end time should be the same value
+    # https://github.com/census-instrumentation/opencensus-python/blob/b28a83f84dbbfb539c90c8844a96e9394df24c5b/opencensus/stats/measure_to_view_map.py#L105L106
+    #
+    # The start and end times should not be used in the calculation of metric
+    # timing information
+    view_data = view_data_module.ViewData(
+        view=view,
+        start_time="2019-05-11T00:07:45.0Z",
+        end_time="2019-05-11T00:07:45.0Z",
+    )
+    return view_data
+
+
+class Producer(object):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def get_metrics(self):
+        return self.metrics
+
+
+def make_stats_exporter(insert_key, metrics, **kwargs):
+    exporter = NewRelicStatsExporter(
+        insert_key, service_name="Python Application", **kwargs
+    )
+    exporter._thread.cancel()
+    exporter._metric_producers = [Producer(metrics)]
+    for view in VIEWS.values():
+        exporter.on_register_view(view)
+    return exporter
+
+
+def make_metrics():
+    view_data_objects = [to_view_data(view) for view in VIEWS.values()]
+    record_values(view_data_objects, {"tag": "foo"}, value=100)
+    return generate_metrics(view_data_objects)
+
+
+SPAN_TIME = datetime.utcnow()
+START_TIME = SPAN_TIME.isoformat() + "Z"
+END_TIME = (SPAN_TIME + timedelta(seconds=1)).isoformat() + "Z"
+SPAN_DATA = {
+    "name": "test_span",
+    "context": span_context.SpanContext(
+        trace_id="2dd43a1d6b2549c6bc2a1a54c2fc0b05", span_id="6e0c63257de34c92"
+    ),
+    "span_id": "6e0c63257de34c92",
+    "parent_span_id": "6e0c63257de34c93",
+    "attributes": {"key1": "value1"},
+    "start_time": START_TIME,
+    "end_time": END_TIME,
+    "span_kind": 0,
+}
+for field in SpanData._fields:
+    if field not in SPAN_DATA:
+        SPAN_DATA[field] = None
+
+SPAN_DATA = SpanData(**SPAN_DATA)
+
+
+ROOT_SPAN = SPAN_DATA._replace(name="root", parent_span_id=None)
+ERROR_SPAN = SPAN_DATA._replace(name="error", status=status_module.Status(2))
+
+
+class Transport(sync.SyncTransport):
+    def export(self, datas):
+        return self.exporter.emit(datas)
@@ -0,0 +1,143 @@
+import gzip
+import json
+import pytest
+from datetime import datetime
+from opencensus.stats import metric_utils
+from opencensus.trace import status as status_module
+from opencensus_ext_newrelic import NewRelicStatsExporter, NewRelicTraceExporter
+from opencensus_ext_newrelic.capture import Recorder, read_capture
+from opencensus_ext_newrelic.replay import main, replay
+from conftest import SPAN_DATA, VIEWS, Transport, record_values, to_view_data
+
+TIMESTAMP = datetime(2019, 5, 11, 0, 7, 45, 123456)
+
+
+@pytest.fixture
+def capture_path(tmpdir):
+    return str(tmpdir.join("workload.nrcap"))
+
+
+def make_metrics():
+    view_data_objects = [to_view_data(view) for view in VIEWS.values()]
+    record_values(view_data_objects, {"tag": "foo"}, value=100, count=2)
+    record_values(view_data_objects, {"tag": "bar"}, value=10)
+    return [
+        metric_utils.view_data_to_metric(view_data, TIMESTAMP)
+        for view_data in view_data_objects
+    ]
+
+
+def test_span_round_trip(capture_path):
+    error_span = SPAN_DATA._replace(status=status_module.Status(2, "error"))
+    with Recorder(capture_path) as recorder:
+        recorder.record_spans([SPAN_DATA, error_span])
+
+    ((kind, offset, spans),) = read_capture(capture_path)
+
+    assert kind == "s"
+    assert offset >= 0
+    for span in spans:
+        assert span.context.trace_id == SPAN_DATA.context.trace_id
+        assert span.context.span_id == SPAN_DATA.context.span_id
+    assert spans[0]._replace(context=None) == SPAN_DATA._replace(context=None)
+    assert spans[1].status.code == 2
+    assert spans[1]._replace(context=None, status=None) == SPAN_DATA._replace(
+        context=None
+    )
+
+
+def test_metric_round_trip(capture_path):
+    metrics = make_metrics()
+    with Recorder(capture_path) as recorder:
+        recorder.record_metrics(metrics, VIEWS)
+        recorder.record_metrics(metrics, VIEWS)
+
+    records = list(read_capture(capture_path))
+    kinds = [kind for kind, _, _ in records]
+    assert kinds == ["v"] * len(VIEWS) + ["m", "m"]
+
+    for _, _, view in records[: len(VIEWS)]:
+        original = VIEWS[view.name]
+        assert type(view.aggregation) is type(original.aggregation)
+        assert view.measure.name == original.measure.name
+        assert view.measure.unit == original.measure.unit
+        assert list(view.columns) == list(original.columns)
+
+    decoded = records[-1][2]
+    for original, metric in zip(metrics, decoded):
+        assert metric.descriptor.name == original.descriptor.name
+        assert metric.descriptor.type == original.descriptor.type
+        for original_series, series in zip(original.time_series, metric.time_series):
+            original_point = original_series.points[0]
+            point = series.points[0]
+            assert series.label_values == original_series.label_values
+            assert point.timestamp == original_point.timestamp
+            assert type(point.value) is type(original_point.value)
+            if hasattr(point.value, "value"):
+                assert point.value.value == original_point.value.value
+            else:
+                assert point.value.count == original_point.value.count
+                assert point.value.sum == original_point.value.sum
+                assert [b.count for b in point.value.buckets] == [
+                    b.count for b in original_point.value.buckets
+                ]
+
+
+def test_exporters_record(capture_path, insert_key):
+    recorder = Recorder(capture_path)
+    trace_exporter = NewRelicTraceExporter(
+        insert_key,
+        service_name="Python Application",
+        transport=Transport,
+        recorder=recorder,
+    )
+    stats_exporter = NewRelicStatsExporter(
+        insert_key, service_name="Python Application", recorder=recorder
+    )
+    stats_exporter._thread.cancel()
+    for view in VIEWS.values():
+        stats_exporter.on_register_view(view)
+
+    trace_exporter.export([SPAN_DATA])
+    stats_exporter.export_metrics(iter(make_metrics()))
+    recorder.close()
+
+    kinds = [kind for kind, _, _ in read_capture(capture_path)]
+    assert kinds == ["s"] + ["v"] * len(VIEWS) + ["m"]
+
+
+@pytest.mark.parametrize("version", (2, None))
+def test_unsupported_capture(capture_path, version):
+    with gzip.open(capture_path, "wb") as capture:
+        header = {"format": "opencensus-ext-newrelic-capture", "version": version}
+        capture.write(json.dumps(header).encode("utf-8") + b"\n")
+
+    with pytest.raises(ValueError):
+        list(read_capture(capture_path))
+
+
+def test_replay(capture_path):
+    metrics = make_metrics()
+    with Recorder(capture_path) as recorder:
+        recorder.record_spans([SPAN_DATA] * 3)
+        recorder.record_metrics(metrics, VIEWS)
+        recorder.record_spans([SPAN_DATA] * 2)
+
+    result = replay(capture_path, speed=0, trace_memory=True)
+
+    assert result.spans == 5
+    assert result.metrics == sum(len(metric.time_series) for metric in metrics)
+    assert result.requests == 2
+    assert result.bytes_sent > 0
+    assert result.peak_memory > 0
+
+
+def test_replay_cli(capture_path, capsys):
+    with Recorder(capture_path) as recorder:
+        recorder.record_spans([SPAN_DATA])
+
+    main([capture_path, "--speed", "0"])
+
+    out = capsys.readouterr().out
+    assert "spans:        1" in out
+    assert "requests:     1" in out
@@ -0,0 +1,108 @@
+import pytest
+from opencensus_ext_newrelic import CircuitBreaker
+from opencensus_ext_newrelic import circuit
+
+
+class Response(object):
+    def __init__(self, status):
+        self.status = status
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit, "monotonic", lambda: now[0])
+    return now
+
+
+def test_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=10)
+
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.state == "closed"
+        assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=10)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == "closed"
+
+
+def test_half_open_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=10)
+    breaker.record_failure()
+
+    clock[0] += 10
+    assert breaker.allow_request()
+    assert breaker.state == "half-open"
+
+    # Only a single probe is allowed through
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow_request()
+
+
+def test_would_allow_keeps_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=10)
+    breaker.record_failure()
+    assert not breaker.would_allow()
+
+    clock[0] += 10
+    assert breaker.would_allow()
+    assert breaker.state == "open"
+
+    assert breaker.allow_request()
+    assert not breaker.would_allow()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=10)
+    breaker.record_failure()
+
+    clock[0] += 10
+    assert breaker.allow_request()
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    clock[0] += 5
+    assert not breaker.allow_request()
+
+
+def test_unrecorded_probe_is_retried(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=10)
+    breaker.record_failure()
+
+    clock[0] += 10
+    assert breaker.allow_request()
+
+    clock[0] += 10
+    assert breaker.allow_request()
+
+
+@pytest.mark.parametrize(
+    "response,failure",
+    (
+        (None, True),
+        (Response(500), True),
+        (Response(503), True),
+        (Response(429), True),
+        (Response(413), False),
+        (Response(202), False),
+    ),
+)
+def test_record_response(response, failure):
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_response(response)
+    assert (breaker.state == "open") is failure
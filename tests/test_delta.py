@@ -0,0 +1,100 @@
+import random
+import pytest
+from opencensus_ext_newrelic import _delta
+from opencensus_ext_newrelic._delta import DeltaState
+
+
+@pytest.fixture(params=("python", "numpy"))
+def vectorize(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+        monkeypatch.setattr(_delta, "VECTORIZE_MIN_SERIES", 0)
+    else:
+        monkeypatch.setattr(_delta, "numpy", None)
+    return request.param == "numpy"
+
+
+def test_new_series_report_raw_values(vectorize):
+    state = DeltaState((int, float))
+
+    deltas = state.update(["a", "b"], [(1, 2.5), (3, 4.0)])
+
+    assert state.vectorized is vectorize
+    assert deltas == [(1, 2.5), (3, 4.0)]
+
+
+def test_deltas(vectorize):
+    state = DeltaState((int, float))
+    state.update(["a", "b"], [(1, 2.5), (3, 4.0)])
+
+    deltas = state.update(["b", "c", "a"], [(5, 3.0), (1, 1.0), (1, 2.5)])
+
+    assert deltas == [(2, -1.0), (1, 1.0), (0, 0.0)]
+    assert len(state) == 3
+
+
+def test_reset_reports_raw_values(vectorize):
+    state = DeltaState((int, float), reset_column=0)
+    state.update(["a", "b"], [(10, 10.0), (10, 10.0)])
+
+    deltas = state.update(["a", "b"], [(2, 4.0), (12, 8.0)])
+
+    assert deltas == [(2, 4.0), (2, -2.0)]
+
+
+def test_no_reset_column_allows_decrease(vectorize):
+    state = DeltaState((float,))
+    state.update(["a"], [(10.0,)])
+
+    assert state.update(["a"], [(4.0,)]) == [(-6.0,)]
+
+
+def test_value_types(vectorize):
+    state = DeltaState((int, float))
+
+    ((count, total),) = state.update(["a"], [(1.0, 2)])
+
+    assert type(count) is int
+    assert type(total) is float
+
+
+def test_compute_stores_values_on_commit(vectorize):
+    state = DeltaState((int,))
+    state.update(["a"], [(1,)])
+
+    # Values that were computed but not committed are reported again
+    assert state.compute(["a", "b"], [(6,), (2,)]) == [(5,), (2,)]
+    assert state.compute(["a", "b"], [(7,), (2,)]) == [(6,), (2,)]
+    state.commit()
+
+    assert state.update(["a", "b"], [(8,), (2,)]) == [(1,), (0,)]
+
+
+def test_vectorized_results_match_python(monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(_delta, "VECTORIZE_MIN_SERIES", 1000)
+
+    rng = random.Random(0)
+    python_state = DeltaState((int, float), reset_column=0)
+    numpy_state = DeltaState((int, float), reset_column=0)
+    totals = {}
+
+    for _ in range(5):
+        keys = rng.sample(range(2000), 800)
+        rows = []
+        for key in keys:
+            count, total = totals.get(key, (0, 0.0))
+            if rng.random() < 0.05:
+                count, total = 0, 0.0
+            count += rng.randint(0, 3)
+            total += rng.random()
+            totals[key] = (count, total)
+            rows.append((count, total))
+
+        with monkeypatch.context() as m:
+            m.setattr(_delta, "numpy", None)
+            expected = python_state.update(keys, rows)
+        assert numpy_state.update(keys, rows) == expected
+
+    assert numpy_state.vectorized
+    assert not python_state.vectorized
@@ -0,0 +1,154 @@
+import threading
+import time
+
+import pytest
+from opencensus.stats import measurement_map
+from opencensus.stats import view_manager as view_manager_module
+from opencensus_ext_newrelic import NewRelicExporter
+from opencensus_ext_newrelic.exporter import Scheduler
+
+from conftest import SPAN_DATA, VIEWS, generate_metrics, record_values, to_view_data
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler()
+    yield scheduler
+    scheduler.stop()
+
+
+def test_scheduler_runs_tasks_with_equal_periods_together(scheduler):
+    runs = []
+    scheduler.schedule(0.05, lambda: runs.append(("a", time.time())))
+    scheduler.schedule(0.05, lambda: runs.append(("b", time.time())))
+    time.sleep(0.12)
+    scheduler.stop()
+
+    assert [name for name, _ in runs[:4]] == ["a", "b", "a", "b"]
+    assert runs[1][1] - runs[0][1] < 0.01
+
+
+def test_cancelled_task_does_not_run(scheduler):
+    runs = []
+    task = scheduler.schedule(0.02, lambda: runs.append(1))
+    task.cancel()
+    time.sleep(0.05)
+
+    assert runs == []
+
+
+def test_failing_task_does_not_stop_scheduler(scheduler, caplog):
+    runs = []
+
+    def fail():
+        raise ValueError("oops")
+
+    scheduler.schedule(0.02, fail)
+    scheduler.schedule(0.02, lambda: runs.append(1))
+    time.sleep(0.05)
+
+    assert runs
+    assert "scheduled export failed" in caplog.text
+
+
+@pytest.fixture
+def exporter(insert_key):
+    exporter = NewRelicExporter(
+        insert_key, service_name="Python Application", interval=3600, wait_period=3600
+    )
+    for view in VIEWS.values():
+        exporter.on_register_view(view)
+    yield exporter
+    exporter.stop()
+
+
+def test_exporter_uses_a_single_thread(insert_key):
+    before = set(threading.enumerate())
+    exporter = NewRelicExporter(insert_key, service_name="Python Application")
+    started = set(threading.enumerate()) - before
+    exporter.stop()
+
+    assert started == {exporter.scheduler._thread}
+    assert not exporter.scheduler._thread.is_alive()
+
+
+def test_exporter_shares_pool_for_same_host(insert_key):
+    exporter = NewRelicExporter(
+        insert_key, service_name="Python Application", host="collector.local"
+    )
+    span_client = exporter.trace_exporter.client
+    metric_client = exporter.stats_exporter.client
+    exporter.stop()
+
+    assert span_client._pool is metric_client._pool
+
+
+def test_exporter_uses_api_hosts_by_default(exporter):
+    span_pool = exporter.trace_exporter.client._pool
+    metric_pool = exporter.stats_exporter.client._pool
+
+    assert span_pool is not metric_pool
+    assert span_pool.host == "trace-api.newrelic.com"
+    assert metric_pool.host == "metric-api.newrelic.com"
+
+
+def test_exporter_shares_circuit_breaker(exporter):
+    assert (
+        exporter.trace_exporter.circuit_breaker
+        is exporter.stats_exporter.circuit_breaker
+    )
+
+
+def test_exporter_intervals(exporter):
+    assert exporter.stats_exporter.interval == 3600
+    assert exporter.trace_exporter._transport.wait_period == 3600
+
+
+def test_scheduler_sends_spans(insert_key):
+    exporter = NewRelicExporter(
+        insert_key, service_name="Python Application", wait_period=0.05
+    )
+    exporter.export([SPAN_DATA])
+    time.sleep(0.15)
+
+    transport = exporter.trace_exporter._transport
+    assert transport.counters["priority"]["exported"] == 0
+    assert transport.counters["bulk"]["exported"] == 1
+    exporter.stop()
+
+
+def test_flush_and_shutdown(exporter):
+    view_data_objects = [to_view_data(view) for view in VIEWS.values()]
+    record_values(view_data_objects, {"tag": "foo"})
+    metrics = generate_metrics(view_data_objects)
+    exporter.stats_exporter._metric_producers = [
+        type("Producer", (), {"get_metrics": lambda self: metrics})()
+    ]
+
+    exporter.export([SPAN_DATA])
+    assert exporter.flush(timeout=1) == {"spans": 0, "metrics": 0}
+
+    exporter.export([SPAN_DATA])
+    assert exporter.shutdown(timeout=1) == {"spans": 0, "metrics": 0}
+    assert not exporter.scheduler._thread.is_alive()
+    assert exporter.trace_exporter._transport is None
+    assert exporter.stats_exporter.client is None
+
+
+def test_view_data_is_not_exported_as_spans(exporter):
+    view_manager = view_manager_module.ViewManager()
+    view_manager.register_exporter(exporter)
+    view_manager.register_view(VIEWS["count"])
+
+    exported = []
+    export = exporter.trace_exporter.export
+    exporter.trace_exporter.export = lambda span_datas: exported.append(
+        span_datas
+    ) or export(span_datas)
+
+    mmap = measurement_map.MeasurementMap(view_manager.measure_to_view_map)
+    mmap.measure_float_put(VIEWS["count"].measure, 1.0)
+    mmap.record()
+
+    assert exported == []
+    assert exporter.trace_exporter._transport.unsent == 0
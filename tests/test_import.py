@@ -0,0 +1,64 @@
+import subprocess
+import sys
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 7), reason="Lazy attributes require Python 3.7+"
+)
+
+
+def imported_modules(statement):
+    """Run statement in a fresh interpreter and return the imported modules
+
+    Uses ``python -X importtime`` which reports every module imported along
+    with its self and cumulative import time in microseconds.
+    """
+    output = subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        cumulative = cumulative.strip()
+        if cumulative.isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def test_package_import_is_lazy():
+    modules = imported_modules("import opencensus_ext_newrelic")
+
+    assert "opencensus_ext_newrelic" in modules
+    assert "opencensus_ext_newrelic.trace" not in modules
+    assert "opencensus_ext_newrelic.stats" not in modules
+    assert "newrelic_telemetry_sdk" not in modules
+
+
+def test_trace_exporter_does_not_import_stats():
+    modules = imported_modules(
+        "from opencensus_ext_newrelic import NewRelicTraceExporter"
+    )
+
+    assert "opencensus_ext_newrelic.trace" in modules
+    assert "opencensus_ext_newrelic.stats" not in modules
+    assert "opencensus.stats.stats" not in modules
+
+
+def test_stats_exporter_does_not_import_trace():
+    modules = imported_modules(
+        "from opencensus_ext_newrelic import NewRelicStatsExporter"
+    )
+
+    assert "opencensus_ext_newrelic.stats" in modules
+    assert "opencensus_ext_newrelic.trace" not in modules
+
+
+def test_unknown_attribute():
+    import opencensus_ext_newrelic
+
+    with pytest.raises(AttributeError):
+        opencensus_ext_newrelic.NotAnExporter
@@ -0,0 +1,172 @@
+import os
+import signal
+import time
+
+import pytest
+from newrelic_telemetry_sdk import MetricClient
+from opencensus_ext_newrelic import NewRelicTraceExporter
+from opencensus_ext_newrelic import lifecycle
+from opencensus_ext_newrelic._stub import StubServer
+from opencensus_ext_newrelic.trace import DefaultTransport
+
+from conftest import (
+    ERROR_SPAN,
+    ROOT_SPAN,
+    SPAN_DATA,
+    VIEWS,
+    make_metrics,
+    make_stats_exporter,
+)
+
+
+class SlowExporter(NewRelicTraceExporter):
+    def __init__(self, *args, **kwargs):
+        super(SlowExporter, self).__init__(*args, **kwargs)
+        self.batches = []
+
+    def emit(self, span_datas):
+        self.batches.append([span.name for span in span_datas])
+        time.sleep(0.2)
+
+
+@pytest.fixture
+def slow_exporter(insert_key):
+    exporter = SlowExporter(
+        insert_key,
+        service_name="Python Application",
+        transport=lambda exporter: DefaultTransport(
+            exporter, max_batch_size=2, wait_period=3600
+        ),
+    )
+    exporter.export([SPAN_DATA] * 4 + [ROOT_SPAN, ERROR_SPAN])
+    yield exporter
+    exporter.shutdown(0)
+
+
+def test_trace_flush_sends_priority_spans_first(slow_exporter):
+    unsent = slow_exporter.flush(timeout=0.1)
+
+    assert unsent == 4
+    assert slow_exporter.batches == [["root", "error"]]
+
+
+def test_trace_shutdown_reports_unsent_spans(slow_exporter, caplog):
+    unsent = slow_exporter.shutdown(timeout=0.1)
+
+    # The batch being sent when the deadline passed is reported as unsent
+    assert unsent == 6
+    assert slow_exporter._transport is None
+    assert "shut down with 6 spans unsent" in caplog.text
+
+
+def test_trace_spans_past_deadline_stay_queued(insert_key):
+    exporter = NewRelicTraceExporter(
+        insert_key,
+        service_name="Python Application",
+        transport=lambda exporter: DefaultTransport(exporter, wait_period=3600),
+    )
+    transport = exporter._transport
+    exporter.export([SPAN_DATA, ROOT_SPAN, SPAN_DATA])
+
+    # The deadline passes before the batch is sent
+    exporter._deadline = lifecycle.deadline(0)
+    assert transport.flush() == 3
+    assert transport.counters["priority"]["pending"] == 1
+    assert transport.counters["bulk"]["pending"] == 2
+
+    exporter._deadline = None
+    assert exporter.shutdown() == 0
+
+
+def test_stats_flush(insert_key):
+    exporter = make_stats_exporter(insert_key, make_metrics())
+
+    assert exporter.flush(timeout=1) == 0
+    exporter.shutdown(0)
+
+
+@pytest.mark.http_response(503)
+def test_stats_shutdown_reports_unsent_metrics(insert_key, caplog):
+    exporter = make_stats_exporter(insert_key, make_metrics())
+
+    assert exporter.shutdown(timeout=1) == len(VIEWS)
+    assert exporter.client is None
+    assert "shut down with 4 metrics unsent" in caplog.text
+
+
+@pytest.mark.http_response(503)
+def test_stats_unsent_counts_series_not_buckets(insert_key):
+    exporter = make_stats_exporter(insert_key, make_metrics(), histogram=True)
+
+    # The distribution is also sent as bucket metrics
+    assert exporter.shutdown(timeout=1) == len(VIEWS)
+
+    # Shutting down again has no effect
+    assert exporter.shutdown() == 0
+
+
+def test_stats_flush_request_is_bounded_by_timeout():
+    with StubServer(latency=1.0) as server:
+        exporter = make_stats_exporter(None, make_metrics())
+        exporter.client = server.client(MetricClient)
+
+        start = time.time()
+        unsent = exporter.flush(timeout=0.1)
+
+    assert unsent == len(VIEWS)
+    assert time.time() - start < 0.9
+
+
+class SleepingExporter(object):
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = []
+
+    def flush(self, timeout=None):
+        self.calls.append(("flush", timeout))
+        time.sleep(self.delay)
+        return 1
+
+    def shutdown(self, timeout=None):
+        self.calls.append(("shutdown", timeout))
+        time.sleep(self.delay)
+        return 2
+
+
+def test_shutdown_runs_exporters_in_parallel():
+    exporters = [SleepingExporter(0.2), SleepingExporter(0.2)]
+
+    start = time.time()
+    assert lifecycle.shutdown(exporters, timeout=1) == [2, 2]
+    assert time.time() - start < 0.35
+
+    assert lifecycle.flush(exporters) == [1, 1]
+    assert exporters[0].calls == [("shutdown", 1), ("flush", None)]
+
+
+def test_flush_reports_exporters_that_did_not_finish():
+    exporters = [SleepingExporter(0), SleepingExporter(1.0)]
+
+    assert lifecycle.flush(exporters, timeout=0.1) == [1, None]
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="requires SIGUSR1")
+def test_register_shutdown(monkeypatch):
+    registered = []
+    monkeypatch.setattr(
+        lifecycle.atexit, "register", lambda *args: registered.append(args)
+    )
+
+    received = []
+    original = signal.signal(signal.SIGUSR1, lambda *args: received.append(args[0]))
+    try:
+        exporter = SleepingExporter(0)
+        lifecycle.register_shutdown([exporter], timeout=2, signals=(signal.SIGUSR1,))
+        os.kill(os.getpid(), signal.SIGUSR1)
+        time.sleep(0.1)
+    finally:
+        signal.signal(signal.SIGUSR1, original)
+
+    assert exporter.calls == [("shutdown", 2)]
+    assert received == [signal.SIGUSR1]
+    assert registered == [(lifecycle.shutdown, [exporter], 2)]
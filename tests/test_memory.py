@@ -0,0 +1,111 @@
+import gc
+import pytest
+from datetime import datetime, timedelta
+from opencensus.trace import span_context
+from opencensus.trace.span_data import SpanData
+from opencensus_ext_newrelic.trace import DefaultTransport, NewRelicTraceExporter
+
+tracemalloc = pytest.importorskip("tracemalloc")
+
+NUM_SPANS = 2000
+
+# Per span memory budgets in bytes. These include the span's ids and its
+# attributes dict. Attribute limits copy the dict, so each queued span owns
+# one copy while the SpanData, and its dict, are freed once released.
+QUEUED_BUDGET = 700
+IN_FLIGHT_BUDGET = 700
+
+
+def make_spans(count):
+    start = datetime.utcnow()
+    spans = []
+    for i in range(count):
+        span_id = "{:016x}".format(i + 1)
+        spans.append(
+            SpanData(
+                name="GET /users/{id}",
+                context=span_context.SpanContext(
+                    trace_id="{:032x}".format(i + 1), span_id=span_id
+                ),
+                span_id=span_id,
+                parent_span_id="{:016x}".format(i + count),
+                attributes={"http.method": "GET", "http.status_code": 200},
+                start_time=start.isoformat() + "Z",
+                end_time=(start + timedelta(milliseconds=i)).isoformat() + "Z",
+                child_span_count=0,
+                stack_trace=None,
+                annotations=[],
+                message_events=[],
+                links=[],
+                status=None,
+                same_process_as_parent_span=None,
+                span_kind=1,
+            )
+        )
+    return spans
+
+
+def traced_memory():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+class Response(object):
+    ok = True
+    status = 202
+
+
+class MeasuringClient(object):
+    """Records the traced memory at the time a batch is sent"""
+
+    def __init__(self):
+        self.memory = None
+
+    def send_batch(self, items, common=None, timeout=None):
+        self.memory = traced_memory()
+        return Response()
+
+
+@pytest.fixture
+def exporter():
+    exporter = NewRelicTraceExporter(
+        "insert-key",
+        service_name="Python Application",
+        transport=lambda exporter: DefaultTransport(
+            exporter,
+            wait_period=3600,
+            max_batch_size=NUM_SPANS,
+            max_queue_size=NUM_SPANS,
+        ),
+    )
+    exporter.client = MeasuringClient()
+    tracemalloc.start()
+    yield exporter
+    tracemalloc.stop()
+    exporter.stop()
+
+
+def test_queued_span_memory(exporter):
+    baseline = traced_memory()
+    spans = make_spans(NUM_SPANS)
+    span_data_memory = (traced_memory() - baseline) / NUM_SPANS
+
+    exporter.export(spans)
+    del spans
+    queued_memory = (traced_memory() - baseline) / NUM_SPANS
+
+    assert exporter._transport.counters["bulk"]["pending"] == NUM_SPANS
+    assert queued_memory < QUEUED_BUDGET
+    assert queued_memory < span_data_memory * 0.6
+
+
+def test_in_flight_span_memory(exporter):
+    exporter.export(make_spans(NUM_SPANS))
+    priority, batch = exporter._transport._next_batch()
+    assert len(batch) == NUM_SPANS
+
+    baseline = traced_memory()
+    exporter.emit(batch)
+    in_flight_memory = (exporter.client.memory - baseline) / NUM_SPANS
+
+    assert in_flight_memory < IN_FLIGHT_BUDGET
@@ -0,0 +1,156 @@
+import json
+import threading
+
+import pytest
+from opencensus.stats import aggregation as aggregation_module
+from opencensus.stats import measure as measure_module
+from opencensus.stats import view as view_module
+from opencensus.stats.bucket_boundaries import BucketBoundaries
+from opencensus_ext_newrelic import NewRelicStatsExporter
+from opencensus_ext_newrelic.recording import MetricRecorder
+
+MEASURE_INT = measure_module.MeasureInt("requests", "Requests", "1")
+MEASURE_FLOAT = measure_module.MeasureFloat("latency", "Latency", "ms")
+
+VIEWS = [
+    view_module.View(
+        "count", "", ("method",), MEASURE_INT, aggregation_module.CountAggregation()
+    ),
+    view_module.View(
+        "sum", "", ("method",), MEASURE_FLOAT, aggregation_module.SumAggregation()
+    ),
+    view_module.View(
+        "last",
+        "",
+        ("method",),
+        MEASURE_FLOAT,
+        aggregation_module.LastValueAggregation(),
+    ),
+    view_module.View(
+        "distribution",
+        "",
+        ("method",),
+        MEASURE_FLOAT,
+        aggregation_module.DistributionAggregation([10.0, 100.0]),
+    ),
+    view_module.View(
+        "distribution.nobounds",
+        "",
+        (),
+        MEASURE_FLOAT,
+        aggregation_module.DistributionAggregation(),
+    ),
+]
+
+
+def point_values(metrics):
+    values = {}
+    for metric in metrics:
+        for timeseries in metric.time_series:
+            labels = tuple(label.value for label in timeseries.label_values)
+            values[(metric.descriptor.name,) + labels] = timeseries.points[0].value
+    return values
+
+
+def record_from_threads(recorder, threads=8, records=1000):
+    def work():
+        for i in range(records):
+            recorder.record("count", 1, ("GET",))
+            recorder.record("sum", 0.5, ("GET",))
+            recorder.record("distribution", i % 200, ("GET",))
+            recorder.record("distribution.nobounds", 1.0)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def test_buffers_are_merged():
+    recorder = MetricRecorder(VIEWS)
+    record_from_threads(recorder)
+    recorder.record("last", 1.0, ("GET",))
+    recorder.record("last", 2.0, ("GET",))
+
+    values = point_values(recorder.get_metrics())
+
+    assert values[("count", "GET")].value == 8000
+    assert values[("sum", "GET")].value == 4000.0
+    assert values[("last", "GET")].value == 2.0
+
+    distribution = values[("distribution", "GET")]
+    assert distribution.count == 8000
+    assert [bucket.count for bucket in distribution.buckets] == [400, 3600, 4000]
+    assert distribution.bucket_options.type_.bounds == [10.0, 100.0]
+
+    assert values[("distribution.nobounds",)].count == 8000
+    assert values[("distribution.nobounds",)].sum == 8000.0
+
+
+def test_finished_threads_are_retired():
+    recorder = MetricRecorder(VIEWS)
+    record_from_threads(recorder, threads=4, records=10)
+
+    first = point_values(recorder.get_metrics())
+    second = point_values(recorder.get_metrics())
+
+    assert recorder._buffers == []
+    assert first[("count", "GET")].value == second[("count", "GET")].value == 40
+
+
+def test_wrapped_bucket_boundaries():
+    # Older versions of opencensus store a BucketBoundaries instance
+    aggregation = aggregation_module.DistributionAggregation()
+    aggregation._boundaries = BucketBoundaries([10.0, 100.0])
+    view = view_module.View("wrapped", "", (), MEASURE_FLOAT, aggregation)
+    recorder = MetricRecorder([view])
+
+    for latency in (5.0, 50.0, 500.0):
+        recorder.record("wrapped", latency)
+
+    distribution = point_values(recorder.get_metrics())[("wrapped",)]
+    assert [bucket.count for bucket in distribution.buckets] == [1, 1, 1]
+    assert distribution.bucket_options.type_.bounds == [10.0, 100.0]
+
+
+def test_tag_values_must_match_columns():
+    recorder = MetricRecorder(VIEWS)
+
+    with pytest.raises(ValueError):
+        recorder.record("count", 1, ("GET", "extra"))
+
+
+def test_stats_exporter_exports_recorder_deltas(insert_key, decompress_payload):
+    exporter = NewRelicStatsExporter(insert_key, service_name="Python Application")
+    exporter._thread.cancel()
+    recorder = MetricRecorder(VIEWS)
+    exporter._metric_producers[:] = []
+    exporter.add_recorder(recorder)
+
+    bodies = []
+    original = exporter._send
+
+    def send(nr_metrics, send, fanout):
+        response, sent = original(nr_metrics, send, fanout)
+        bodies.append(json.loads(decompress_payload(response.request.body)))
+        return response, sent
+
+    exporter._send = send
+
+    for _ in range(3):
+        recorder.record("count", 1, ("GET",))
+    assert exporter.flush() == 0
+
+    for _ in range(2):
+        recorder.record("count", 1, ("GET",))
+    assert exporter.flush() == 0
+    exporter.shutdown()
+
+    counts = [
+        [metric["value"] for metric in body[0]["metrics"] if metric["name"] == "count"]
+        for body in bodies
+    ]
+    # Shutting down sends a final zero delta
+    assert counts == [[3], [2], [0]]
+    assert exporter._producer_chain.producers == [recorder]
@@ -0,0 +1,224 @@
+import time
+
+import pytest
+from newrelic_telemetry_sdk import MetricClient, SpanClient
+from opencensus.common.transports.sync import SyncTransport
+from opencensus_ext_newrelic import NewRelicTraceExporter
+from opencensus_ext_newrelic import shaping
+from opencensus_ext_newrelic._stub import StubServer
+from opencensus_ext_newrelic.shaping import Shaper
+from opencensus_ext_newrelic.trace import DefaultTransport
+
+from conftest import SPAN_DATA, VIEWS, make_metrics, make_stats_exporter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(shaping, "monotonic", lambda: now[0])
+    monkeypatch.setattr(shaping.time, "sleep", sleep)
+    return now, sleeps
+
+
+def test_requests_are_paced(clock):
+    _, sleeps = clock
+    shaper = Shaper(requests_per_second=10, burst=0.2)
+
+    for _ in range(4):
+        assert shaper.acquire(100)
+
+    assert sleeps == [pytest.approx(0.1), pytest.approx(0.1)]
+    assert shaper.counters == {
+        "requests": 4,
+        "bytes": 400,
+        "throttled": 2,
+        "throttled_seconds": pytest.approx(0.2),
+    }
+
+
+def test_bytes_are_paced(clock):
+    now, sleeps = clock
+    shaper = Shaper(bytes_per_second=1000)
+
+    # A payload larger than the burst is delayed, not refused
+    assert shaper.acquire(1500)
+    assert sleeps == [pytest.approx(0.5)]
+
+    now[0] += 2.0
+    assert shaper.acquire(1000)
+    assert len(sleeps) == 1
+
+
+def test_slowest_limit_applies(clock):
+    _, sleeps = clock
+    shaper = Shaper(bytes_per_second=1000, requests_per_second=100, burst=0)
+
+    shaper.acquire(500)
+    shaper.acquire(10)
+
+    assert sleeps == [pytest.approx(0.5), pytest.approx(0.01)]
+
+
+def test_deadline_is_not_exceeded(clock):
+    now, sleeps = clock
+    shaper = Shaper(bytes_per_second=1000, burst=0)
+
+    assert not shaper.acquire(1000, deadline=now[0] + 0.5)
+    assert shaper.acquire(400, deadline=now[0] + 0.5)
+
+    assert sleeps == [pytest.approx(0.4)]
+    assert shaper.counters["requests"] == 1
+
+
+def test_no_limits(clock):
+    _, sleeps = clock
+    shaper = Shaper()
+
+    assert shaper.acquire(10**9)
+    assert sleeps == []
+
+
+def test_trace_exporter_batches_are_paced():
+    shaper = Shaper(requests_per_second=20, burst=0)
+    with StubServer() as server:
+        exporter = NewRelicTraceExporter(
+            "insert-key",
+            service_name="Python Application",
+            transport=SyncTransport,
+            shaper=shaper,
+        )
+        exporter.client = server.client(SpanClient)
+
+        start = time.time()
+        for _ in range(4):
+            response = exporter.emit([SPAN_DATA])
+            assert response.status == 202
+        elapsed = time.time() - start
+        exporter.shutdown()
+
+    assert server.requests == 4
+    assert server.bytes_received == shaper.counters["bytes"]
+    assert shaper.counters["throttled"] == 3
+    assert elapsed >= 0.15
+    assert shaper.counters["throttled_seconds"] > 0.1
+
+
+def test_destinations_share_shaper():
+    shaper = Shaper(requests_per_second=1000)
+    primary, destination = StubServer(), StubServer()
+    for server in (primary, destination):
+        server.start()
+
+    exporter = NewRelicTraceExporter(
+        "insert-key",
+        service_name="Python Application",
+        transport=SyncTransport,
+        destinations=[{"insert_key": "other"}],
+        shaper=shaper,
+    )
+    exporter.client = primary.client(SpanClient)
+    exporter._fanout.destinations[0].client = destination.client(SpanClient)
+
+    exporter.emit([SPAN_DATA])
+    exporter.shutdown()
+
+    for server in (primary, destination):
+        server.stop()
+
+    assert (primary.requests, destination.requests) == (1, 1)
+    assert shaper.counters["requests"] == 2
+    assert shaper.counters["bytes"] == (
+        primary.bytes_received + destination.bytes_received
+    )
+
+
+def test_stats_exporter_metrics_are_paced():
+    shaper = Shaper(requests_per_second=10, burst=0)
+    with StubServer() as server:
+        exporter = make_stats_exporter(None, make_metrics(), shaper=shaper)
+        exporter.client = server.client(MetricClient)
+
+        assert exporter.flush() == 0
+        assert exporter.flush() == 0
+        exporter.shutdown()
+
+    assert server.requests == shaper.counters["requests"] == 3
+    assert shaper.counters["throttled"] == 2
+    assert shaper.counters["throttled_seconds"] > 0.1
+
+
+def test_trace_flush_does_not_wait_past_deadline():
+    shaper = Shaper(requests_per_second=0.1)
+    with StubServer() as server:
+        exporter = NewRelicTraceExporter(
+            "insert-key",
+            service_name="Python Application",
+            transport=lambda exporter: DefaultTransport(
+                exporter, max_batch_size=10, wait_period=3600
+            ),
+            shaper=shaper,
+        )
+        exporter.client = server.client(SpanClient)
+        exporter.export([SPAN_DATA] * 30)
+
+        start = time.time()
+        unsent = exporter.flush(timeout=1.0)
+        elapsed = time.time() - start
+        exporter.shutdown(0)
+
+    # Batches that would wait past the deadline stay queued
+    assert unsent == 20
+    assert elapsed < 1.0
+    assert server.requests == shaper.counters["requests"] == 1
+
+
+def test_destinations_are_not_sent_batches_held_back():
+    shaper = Shaper(requests_per_second=5, burst=0)
+    primary, destination = StubServer(), StubServer()
+    for server in (primary, destination):
+        server.start()
+
+    exporter = NewRelicTraceExporter(
+        "insert-key",
+        service_name="Python Application",
+        transport=lambda exporter: DefaultTransport(
+            exporter, max_batch_size=10, wait_period=3600
+        ),
+        destinations=[{"insert_key": "other"}],
+        shaper=shaper,
+    )
+    exporter.client = primary.client(SpanClient)
+    exporter._fanout.destinations[0].client = destination.client(SpanClient)
+    exporter.export([SPAN_DATA] * 30)
+
+    assert exporter.flush(timeout=0.1) == 20
+    assert exporter.shutdown() == 0
+
+    for server in (primary, destination):
+        server.stop()
+
+    # Batches held back at the deadline are published once they are sent
+    assert (primary.requests, destination.requests) == (3, 3)
+
+
+def test_stats_flush_does_not_wait_past_deadline():
+    shaper = Shaper(bytes_per_second=1, burst=0)
+    with StubServer() as server:
+        exporter = make_stats_exporter(None, make_metrics(), shaper=shaper)
+        exporter.client = server.client(MetricClient)
+
+        start = time.time()
+        unsent = exporter.flush(timeout=0.1)
+        elapsed = time.time() - start
+        exporter.shutdown(0)
+
+    assert unsent == len(VIEWS)
+    assert elapsed < 0.1
+    assert server.requests == 0
+    assert shaper.counters["requests"] == 0
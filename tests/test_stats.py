@@ -1,55 +1,24 @@
 import logging
 import json
 import pytest
-import time
-from datetime import datetime
 from opencensus.stats import aggregation as aggregation_module
-from opencensus.stats import measure as measure_module
-from opencensus.tags import tag_map as tag_map_module
 from opencensus.stats import view as view_module
-from opencensus.stats import view_data as view_data_module
 from opencensus.stats import metric_utils
-from opencensus_ext_newrelic import NewRelicStatsExporter
+from opencensus_ext_newrelic import CircuitBreaker, NewRelicStatsExporter, lifecycle
+from opencensus_ext_newrelic.shaping import Shaper
 from newrelic_telemetry_sdk import MetricClient
-
-
-# The latency in milliseconds
-MEASURE = measure_module.MeasureFloat("number", "A number!", "things")
-
-GAUGE_VIEWS = {
-    "last": view_module.View(
-        "last",
-        "A last value",
-        ("tag",),
-        MEASURE,
-        aggregation_module.LastValueAggregation(),
-    )
-}
-COUNT_VIEWS = {
-    "count": view_module.View(
-        "count", "A count", ("tag",), MEASURE, aggregation_module.CountAggregation()
-    ),
-    "sum": view_module.View(
-        "sum", "A sum", ("tag",), MEASURE, aggregation_module.SumAggregation()
-    ),
-}
-DISTRIBUTION_VIEWS = {
-    "distribution": view_module.View(
-        "distribution",
-        "A distribution",
-        ("tag",),
-        MEASURE,
-        aggregation_module.DistributionAggregation([50.0, 200.0]),
-    )
-}
-VIEWS = {}
-VIEWS.update(GAUGE_VIEWS)
-VIEWS.update(COUNT_VIEWS)
-VIEWS.update(DISTRIBUTION_VIEWS)
-
-TEST_TIME = time.time()
-EXPECTED_TIMESTAMP = int(TEST_TIME * 1000.0)
-TEST_TIMESTAMP = datetime.utcfromtimestamp(TEST_TIME)
+from conftest import (
+    COUNT_VIEWS,
+    DISTRIBUTION_VIEWS,
+    EXPECTED_TIMESTAMP,
+    GAUGE_VIEWS,
+    MEASURE,
+    TEST_TIMESTAMP,
+    VIEWS,
+    generate_metrics,
+    record_values,
+    to_view_data,
+)
 
 
 class InvalidPoint(object):
@@ -87,37 +56,6 @@ def stats_exporter(insert_key, hosts):
     return exporter
 
 
-def record_values(view_data_objects, tags, value=1, count=1):
-    tag_map = tag_map_module.TagMap(tags)
-    for view_data_object in view_data_objects:
-        for _ in range(count):
-            # Timestamp here is only used to record exemplars. It is safe to
-            # leave it as None
-            view_data_object.record(tag_map, value, None)
-
-
-def generate_metrics(view_data_objects):
-    metrics = []
-    for view_data_object in view_data_objects:
-        metric = metric_utils.view_data_to_metric(view_data_object, TEST_TIMESTAMP)
-        metrics.append(metric)
-    return metrics
-
-
-def to_view_data(view):
-    # Start and end time should be the same value
-    # https://github.com/census-instrumentation/opencensus-python/blob/b28a83f84dbbfb539c90c8844a96e9394df24c5b/opencensus/stats/measure_to_view_map.py#L105L106
-    #
-    # The start and end times should not be used in the calculation of metric
-    # timing information
-    view_data = view_data_module.ViewData(
-        view=view,
-        start_time="2019-05-11T00:07:45.0Z",
-        end_time="2019-05-11T00:07:45.0Z",
-    )
-    return view_data
-
-
 @pytest.mark.parametrize(
     "tag_values",
     ((None,), ("foo",), ("foo", "bar")),
@@ -341,3 +279,358 @@ def test_invalid_point(stats_exporter, caplog):
         logging.WARNING,
         "Unable to send metric invalid with value: invalid",
     ) in caplog.record_tuples
+
+
+@pytest.mark.http_response(status_code=503)
+def test_open_circuit_defers_deltas(stats_exporter, decompress_payload):
+    breaker = stats_exporter.circuit_breaker = CircuitBreaker(failure_threshold=1)
+    view_data_objects = [to_view_data(view) for view in COUNT_VIEWS.values()]
+
+    record_values(view_data_objects, {"tag": "first"}, count=1)
+    stats_exporter.export_metrics(generate_metrics(view_data_objects))
+    assert breaker.state == "open"
+
+    # Exports are skipped while the circuit is open
+    record_values(view_data_objects, {"tag": "first"}, count=2)
+    assert stats_exporter.export_metrics(generate_metrics(view_data_objects)) is None
+
+    # Once the endpoint recovers, the skipped values are included in the delta
+    breaker.record_success()
+    response = stats_exporter.export_metrics(generate_metrics(view_data_objects))
+    data = json.loads(decompress_payload(response.request.body))
+    for metric in data[0]["metrics"]:
+        assert metric["value"] == 2
+
+
+def test_empty_export_keeps_probe(stats_exporter):
+    breaker = stats_exporter.circuit_breaker = CircuitBreaker(
+        failure_threshold=1, cooldown=0
+    )
+    breaker.record_failure()
+
+    # Nothing is sent, so the probe is left for the next request
+    assert stats_exporter.export_metrics([]) is None
+    assert breaker.state == "open"
+    assert breaker.allow_request()
+
+
+def test_client_is_created_on_first_export(stats_exporter):
+    assert stats_exporter._client is None
+
+    view_data = to_view_data(VIEWS["last"])
+    view_data.record(None, 100, None)
+    stats_exporter.export_metrics(
+        [metric_utils.view_data_to_metric(view_data, TEST_TIMESTAMP)]
+    )
+
+    assert isinstance(stats_exporter._client, MetricClient)
+
+
+def test_skip_unchanged_series(stats_exporter, decompress_payload):
+    stats_exporter.skip_unchanged = True
+    view_data_objects = [to_view_data(view) for view in VIEWS.values()]
+    record_values(view_data_objects, {"tag": "first"}, value=1.0)
+    record_values(view_data_objects, {"tag": "second"}, value=1.0)
+    stats_exporter.export_metrics(generate_metrics(view_data_objects))
+
+    # Only update the "first" series
+    record_values(view_data_objects, {"tag": "first"}, value=1.0)
+    response = stats_exporter.export_metrics(generate_metrics(view_data_objects))
+    data = json.loads(decompress_payload(response.request.body))
+
+    reported = set()
+    for metric in data[0]["metrics"]:
+        reported.add((metric["name"], metric["attributes"]["tag"]))
+        if metric["name"] in COUNT_VIEWS:
+            assert metric["value"] == 1
+
+    # Gauges are always reported
+    expected = {(view_name, "first") for view_name in VIEWS}
+    expected.update((view_name, "second") for view_name in GAUGE_VIEWS)
+    assert reported == expected
+
+    # Nothing is sent when no cumulative series changed and there are no gauges
+    view_data_objects = [to_view_data(view) for view in COUNT_VIEWS.values()]
+    record_values(view_data_objects, {"tag": "third"})
+    stats_exporter.export_metrics(generate_metrics(view_data_objects))
+    assert stats_exporter.export_metrics(generate_metrics(view_data_objects)) is None
+
+
+def test_skip_unchanged_views(stats_exporter, monkeypatch):
+    stats_exporter.skip_unchanged = True
+    view_data_objects = [to_view_data(view) for view in COUNT_VIEWS.values()]
+    record_values(view_data_objects, {"tag": "foo"})
+    stats_exporter.export_metrics(generate_metrics(view_data_objects))
+
+    updated = []
+    for name, state in stats_exporter.merged_values.items():
+        compute = state.compute
+        monkeypatch.setattr(
+            state,
+            "compute",
+            lambda keys, rows, name=name, compute=compute: updated.append(name)
+            or compute(keys, rows),
+        )
+
+    # Only the "count" view changed, so the deltas of "sum" are not computed
+    record_values(view_data_objects[:1], {"tag": "foo"})
+    stats_exporter.export_metrics(generate_metrics(view_data_objects))
+    assert updated == ["count"]
+
+    assert stats_exporter.export_metrics(generate_metrics(view_data_objects)) is None
+    assert updated == ["count"]
+
+
+@pytest.mark.http_response(status_code=503)
+def test_fanout_while_primary_circuit_is_open(insert_key):
+    exporter = NewRelicStatsExporter(
+        insert_key,
+        service_name="Python Application",
+        circuit_breaker=CircuitBreaker(failure_threshold=1),
+        destinations=[{"insert_key": "other"}],
+    )
+    exporter._thread.cancel()
+    for view in VIEWS.values():
+        exporter.on_register_view(view)
+    destination = exporter._fanout.destinations[0]
+    destination.max_retries = 0
+
+    view_data = to_view_data(VIEWS["last"])
+    view_data.record(None, 100, None)
+    metrics = [metric_utils.view_data_to_metric(view_data, TEST_TIMESTAMP)]
+
+    assert exporter.export_metrics(metrics) is not None
+    assert exporter.circuit_breaker.state == "open"
+
+    # The primary is skipped but the destination is still sent the metrics
+    assert exporter.export_metrics(metrics) is None
+    exporter._fanout.stop()
+    assert destination.counters["failed"] == 2
+
+
+def test_primary_receives_outage_deltas_with_fanout(insert_key):
+    exporter = NewRelicStatsExporter(
+        insert_key,
+        service_name="Python Application",
+        destinations=[{"insert_key": "other"}],
+    )
+    exporter._thread.cancel()
+    exporter.on_register_view(COUNT_VIEWS["count"])
+    breaker = exporter.circuit_breaker
+
+    sent = []
+    send = exporter._send
+
+    def _send(nr_metrics, primary, fanout):
+        sent.append(
+            (
+                primary,
+                fanout is not None,
+                [metric["value"] for metric in nr_metrics],
+            )
+        )
+        return send(nr_metrics, primary, fanout)
+
+    exporter._send = _send
+    view_data = to_view_data(COUNT_VIEWS["count"])
+
+    def export(count):
+        del sent[:]
+        record_values([view_data], {"tag": "foo"}, count=count)
+        exporter.export_metrics(generate_metrics([view_data]))
+        return list(sent)
+
+    assert export(2) == [(True, True, [2])]
+
+    # The destination is sent the outage deltas while the primary is skipped
+    breaker.failure_threshold = 1
+    breaker.record_failure()
+    assert export(5) == [(False, True, [5])]
+
+    # Once the circuit closes, the primary is sent all deltas of the outage
+    breaker.record_success()
+    assert export(1) == [(False, True, [1]), (True, False, [6])]
+
+    # Both share a single payload again
+    assert export(1) == [(True, True, [1])]
+    exporter.shutdown()
+
+
+def test_deltas_held_back_are_sent_next_export(insert_key):
+    exporter = NewRelicStatsExporter(
+        insert_key,
+        service_name="Python Application",
+        shaper=Shaper(requests_per_second=5, burst=0),
+    )
+    exporter._thread.cancel()
+    exporter.on_register_view(COUNT_VIEWS["count"])
+
+    sent = []
+    send = exporter._send
+
+    def _send(nr_metrics, primary, fanout):
+        response, ok = send(nr_metrics, primary, fanout)
+        if ok:
+            sent.append([metric["value"] for metric in nr_metrics])
+        return response, ok
+
+    exporter._send = _send
+    view_data = to_view_data(COUNT_VIEWS["count"])
+
+    def export(count, timeout=None):
+        record_values([view_data], {"tag": "foo"}, count=count)
+        exporter._deadline = lifecycle.deadline(timeout)
+        try:
+            return exporter._export(generate_metrics([view_data]))[1]
+        finally:
+            exporter._deadline = None
+
+    assert export(1) == 0
+
+    # Stopped by the shaper and by the deadline before anything is sent
+    assert export(5, timeout=0.05) == 1
+    assert export(2, timeout=0) == 1
+
+    # The next export is sent every delta held back
+    assert export(1) == 0
+    assert sent == [[1], [8]]
+    exporter.shutdown()
+
+
+def test_histogram_exports_bucket_deltas(stats_exporter, decompress_payload):
+    stats_exporter.histogram = True
+    view_data = to_view_data(DISTRIBUTION_VIEWS["distribution"])
+
+    def export(values):
+        for value in values:
+            record_values([view_data], {"tag": "foo"}, value=value)
+        metrics = generate_metrics([view_data])
+        response = stats_exporter.export_metrics(metrics)
+        data = json.loads(decompress_payload(response.request.body))
+        metrics_data = data[0]["metrics"]
+        (summary,) = [m for m in metrics_data if m["type"] == "summary"]
+        return summary, [m for m in metrics_data if m["type"] != "summary"]
+
+    summary, buckets = export([10, 100, 100, 300])
+    assert summary["value"]["count"] == 4
+    assert {
+        metric["attributes"]["le"]: metric["value"] for metric in buckets
+    } == {"50.0": 1, "200.0": 3, "+Inf": 4}
+    for metric in buckets:
+        assert metric["name"] == "distribution.bucket"
+        assert metric["type"] == "count"
+        assert metric["attributes"]["tag"] == "foo"
+
+    # Empty leading buckets are omitted
+    summary, buckets = export([100])
+    assert summary["value"]["count"] == 1
+    assert {
+        metric["attributes"]["le"]: metric["value"] for metric in buckets
+    } == {"200.0": 1, "+Inf": 1}
+
+
+def test_rollups_merge_series(stats_exporter, decompress_payload):
+    columns = ("tag", "other")
+    views = [
+        view_module.View(
+            "rolled.count", "", columns, MEASURE, aggregation_module.CountAggregation()
+        ),
+        view_module.View(
+            "rolled.distribution",
+            "",
+            columns,
+            MEASURE,
+            aggregation_module.DistributionAggregation([50.0]),
+        ),
+        view_module.View(
+            "rolled.last",
+            "",
+            columns,
+            MEASURE,
+            aggregation_module.LastValueAggregation(),
+        ),
+    ]
+    for view in views:
+        stats_exporter.on_register_view(view)
+    stats_exporter.rollups = {view.name: ("tag",) for view in views}
+    stats_exporter.histogram = True
+
+    view_data_objects = [to_view_data(view) for view in views]
+    record_values(view_data_objects, {"tag": "a", "other": "x"}, value=10)
+    record_values(view_data_objects, {"tag": "a", "other": "y"}, value=100)
+    record_values(view_data_objects, {"tag": "b", "other": "x"}, value=10)
+
+    response = stats_exporter.export_metrics(generate_metrics(view_data_objects))
+    data = json.loads(decompress_payload(response.request.body))
+
+    values = {}
+    for metric in data[0]["metrics"]:
+        attributes = metric["attributes"]
+        key = (metric["name"], attributes["tag"], attributes.get("le"))
+        if metric["name"] == "rolled.last":
+            assert attributes["other"] in ("x", "y")
+            continue
+
+        assert "other" not in attributes
+        assert key not in values
+        values[key] = metric["value"]
+
+    assert values == {
+        ("rolled.count", "a", None): 2,
+        ("rolled.count", "b", None): 1,
+        ("rolled.distribution", "a", None): {
+            "count": 2,
+            "sum": 110.0,
+            "min": None,
+            "max": None,
+        },
+        ("rolled.distribution", "b", None): {
+            "count": 1,
+            "sum": 10.0,
+            "min": None,
+            "max": None,
+        },
+        ("rolled.distribution.bucket", "a", "50.0"): 1,
+        ("rolled.distribution.bucket", "a", "+Inf"): 2,
+        ("rolled.distribution.bucket", "b", "50.0"): 1,
+        ("rolled.distribution.bucket", "b", "+Inf"): 1,
+    }
+    assert len(stats_exporter.merged_values["rolled.count"]) == 2
+
+
+def test_rollup_unknown_column(stats_exporter, caplog):
+    stats_exporter.rollups = {"count": ("tag", "missing")}
+    view_data = to_view_data(COUNT_VIEWS["count"])
+    record_values([view_data], {"tag": "foo"})
+
+    stats_exporter.export_metrics(generate_metrics([view_data]))
+
+    assert "Rollup column 'missing' is not a column of view count." in caplog.text
+
+
+def test_common_attributes(insert_key, decompress_payload):
+    exporter = NewRelicStatsExporter(
+        insert_key,
+        service_name="Python Application",
+        common_attributes={"region": "us"},
+        hoist_attributes=True,
+    )
+    exporter._thread.cancel()
+    for view in COUNT_VIEWS.values():
+        exporter.on_register_view(view)
+
+    view_data_objects = [to_view_data(view) for view in COUNT_VIEWS.values()]
+    record_values(view_data_objects, {"tag": "foo"})
+    response = exporter.export_metrics(generate_metrics(view_data_objects))
+
+    data = json.loads(decompress_payload(response.request.body))[0]
+    assert data["common"]["interval.ms"] == exporter.interval * 1000
+    assert data["common"]["attributes"] == {
+        "service.name": "Python Application",
+        "region": "us",
+        "measure.name": MEASURE.name,
+        "measure.unit": MEASURE.unit,
+        "tag": "foo",
+    }
+    for metric in data["metrics"]:
+        assert "attributes" not in metric
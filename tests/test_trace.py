@@ -1,18 +1,24 @@
+import functools
 import logging
 import json
 import pytest
-from datetime import datetime, timedelta
-from opencensus_ext_newrelic import NewRelicTraceExporter
-from opencensus_ext_newrelic.trace import DefaultTransport
-from opencensus.common.transports import sync
+import time
+from datetime import datetime
+from opencensus_ext_newrelic import CircuitBreaker, NewRelicTraceExporter
+from opencensus_ext_newrelic._client import Fanout
+from opencensus_ext_newrelic._stub import StubServer
+from opencensus_ext_newrelic.lifecycle import deadline
+from opencensus_ext_newrelic.trace import (
+    DEADLINE_EXCEEDED,
+    AttributeLimits,
+    DefaultTransport,
+    PRIORITY_ATTRIBUTE,
+    ShardedTransport,
+    intern,
+)
 from opencensus.trace import span_context
-from opencensus.trace.span_data import SpanData
 from newrelic_telemetry_sdk import SpanClient
-
-
-class Transport(sync.SyncTransport):
-    def export(self, datas):
-        return self.exporter.emit(datas)
+from conftest import ERROR_SPAN, ROOT_SPAN, SPAN_DATA, SPAN_TIME, Transport
 
 
 @pytest.fixture
@@ -26,31 +32,9 @@ def trace_exporter(hosts, insert_key):
     return exporter
 
 
-TEST_TIME = datetime.utcnow()
-START_TIME = TEST_TIME.isoformat() + "Z"
-END_TIME = (TEST_TIME + timedelta(seconds=1)).isoformat() + "Z"
-SPAN_DATA = {
-    "name": "test_span",
-    "context": span_context.SpanContext(
-        trace_id="2dd43a1d6b2549c6bc2a1a54c2fc0b05", span_id="6e0c63257de34c92"
-    ),
-    "span_id": "6e0c63257de34c92",
-    "parent_span_id": "6e0c63257de34c93",
-    "attributes": {"key1": "value1"},
-    "start_time": START_TIME,
-    "end_time": END_TIME,
-    "span_kind": 0,
-}
-for field in SpanData._fields:
-    if field not in SPAN_DATA:
-        SPAN_DATA[field] = None
-
-SPAN_DATA = SpanData(**SPAN_DATA)
-
-
 def test_trace(trace_exporter, decompress_payload):
     duration = 1000
-    timestamp = int((TEST_TIME - datetime(1970, 1, 1)).total_seconds() * 1000.0)
+    timestamp = int((SPAN_TIME - datetime(1970, 1, 1)).total_seconds() * 1000.0)
 
     response = trace_exporter.export([SPAN_DATA])
 
@@ -141,3 +125,380 @@ def test_override_exporter_values(insert_key):
     assert isinstance(exporter._transport, CustomTransport)
     assert exporter.client._pool.host == host
     assert exporter.client._pool.port == port
+
+
+@pytest.mark.http_response(status_code=503)
+def test_open_circuit_drops_spans(hosts, insert_key):
+    breaker = CircuitBreaker(failure_threshold=2)
+    exporter = NewRelicTraceExporter(
+        insert_key=insert_key,
+        transport=Transport,
+        host=hosts["trace"],
+        service_name="Python Application",
+        circuit_breaker=breaker,
+    )
+
+    assert exporter.export([SPAN_DATA]) is not None
+    assert exporter.export([SPAN_DATA]) is not None
+
+    assert breaker.state == "open"
+    assert exporter.export([SPAN_DATA]) is None
+
+
+def test_spans_past_deadline_keep_probe(trace_exporter):
+    breaker = trace_exporter.circuit_breaker = CircuitBreaker(
+        failure_threshold=1, cooldown=0
+    )
+    breaker.record_failure()
+
+    trace_exporter._deadline = deadline(0)
+    assert trace_exporter.emit([SPAN_DATA]) is DEADLINE_EXCEEDED
+    assert breaker.state == "open"
+    assert breaker.allow_request()
+
+
+def test_client_is_created_on_first_export(trace_exporter):
+    assert trace_exporter._client is None
+
+    trace_exporter.export([SPAN_DATA])
+
+    assert isinstance(trace_exporter._client, SpanClient)
+
+
+class RecordingExporter(NewRelicTraceExporter):
+    def __init__(self, *args, **kwargs):
+        super(RecordingExporter, self).__init__(*args, **kwargs)
+        self.batches = []
+
+    def emit(self, span_datas):
+        self.batches.append(span_datas)
+
+
+@pytest.fixture
+def recording_exporter(insert_key):
+    exporter = RecordingExporter(
+        insert_key,
+        service_name="Python Application",
+        transport=lambda exporter: DefaultTransport(
+            exporter,
+            max_batch_size=3,
+            wait_period=3600,
+            max_queue_size=4,
+            max_priority_queue_size=2,
+        ),
+    )
+    yield exporter
+    exporter.stop()
+
+
+FLAGGED_SPAN = SPAN_DATA._replace(name="flagged", attributes={PRIORITY_ATTRIBUTE: True})
+
+
+def test_priority_spans_are_sent_first(recording_exporter):
+    recording_exporter.export([SPAN_DATA, ROOT_SPAN, SPAN_DATA, ERROR_SPAN])
+    recording_exporter._transport.flush()
+
+    batches = recording_exporter.batches
+    assert [[span.name for span in batch] for batch in batches] == [
+        ["root", "error", "test_span"],
+        ["test_span"],
+    ]
+
+
+def test_lanes_are_bounded_separately(recording_exporter):
+    transport = recording_exporter._transport
+    recording_exporter.export([SPAN_DATA] * 6)
+    recording_exporter.export([ROOT_SPAN, ERROR_SPAN, FLAGGED_SPAN])
+
+    assert transport.counters == {
+        "priority": {"enqueued": 3, "dropped": 1, "exported": 0, "pending": 2},
+        "bulk": {"enqueued": 6, "dropped": 2, "exported": 0, "pending": 4},
+    }
+
+    transport.flush()
+
+    # The oldest priority span was evicted
+    assert [span.name for span in recording_exporter.batches[0][:2]] == [
+        "error",
+        "flagged",
+    ]
+    assert transport.counters["priority"]["exported"] == 2
+    assert transport.counters["bulk"]["exported"] == 4
+
+
+def test_stop_sends_pending_spans(recording_exporter):
+    recording_exporter.export([SPAN_DATA, ROOT_SPAN])
+    recording_exporter._transport.stop()
+
+    assert len(recording_exporter.batches) == 1
+    assert not recording_exporter._transport._thread.is_alive()
+
+
+def test_attribute_limits():
+    limits = AttributeLimits(max_attributes=3, max_value_length=4, max_bytes=1024)
+    attributes = {"a": "abcdefgh", "b": 1, "c": "xy", "d": True}
+
+    limited = limits.apply(attributes)
+
+    assert limited == {"a": "abcd", "b": 1, "c": "xy"}
+    assert limits.counters == {
+        "truncated_values": 1,
+        "truncated_chars": 4,
+        "dropped_attributes": 1,
+    }
+
+
+def test_attribute_limits_total_bytes():
+    limits = AttributeLimits(max_bytes=20)
+    attributes = {"a": "x" * 10, "b": "y" * 10, "c": 1}
+
+    assert limits.apply(attributes) == {"a": "x" * 10}
+    assert limits.dropped_attributes == 2
+
+
+def test_attribute_keys_are_interned():
+    limited = AttributeLimits().apply({"".join(["http.", "url"]): "/"})
+
+    (key,) = limited
+    assert key is intern("".join(["http.", "url"]))
+
+
+def test_queued_spans_are_limited(recording_exporter):
+    recording_exporter.attribute_limits = AttributeLimits(max_value_length=3)
+    span = SPAN_DATA._replace(attributes={"http.url": "/users"})
+    recording_exporter.export([span])
+    recording_exporter._transport.flush()
+
+    (batch,) = recording_exporter.batches
+    assert batch[0].tags == {"http.url": "/us"}
+    assert recording_exporter.attribute_limits.truncated_values == 1
+
+
+def test_export_limits_attributes(trace_exporter, decompress_payload):
+    trace_exporter.attribute_limits = AttributeLimits(max_value_length=3)
+    response = trace_exporter.export([SPAN_DATA])
+
+    data = json.loads(decompress_payload(response.request.body))
+    attributes = data[0]["spans"][0]["attributes"]
+    assert attributes["key1"] == "val"
+    assert trace_exporter.attribute_limits.truncated_chars == 3
+
+
+def test_common_attributes(hosts, insert_key, decompress_payload):
+    exporter = NewRelicTraceExporter(
+        insert_key,
+        service_name="Python Application",
+        transport=Transport,
+        host=hosts["trace"],
+        common_attributes={"region": "us", "service.name": "ignored"},
+        hoist_attributes=True,
+    )
+    spans = [
+        SPAN_DATA._replace(attributes={"host": "a", "version": 1, "id": 1}),
+        SPAN_DATA._replace(attributes={"host": "a", "version": 1, "id": 2}),
+        SPAN_DATA._replace(attributes={"host": "a", "version": True, "id": 3}),
+    ]
+    response = exporter.export(spans)
+
+    data = json.loads(decompress_payload(response.request.body))[0]
+    assert data["common"]["attributes"] == {
+        "service.name": "Python Application",
+        "region": "us",
+        "host": "a",
+    }
+    for span, span_data in zip(data["spans"], spans):
+        attributes = span["attributes"]
+        assert "host" not in attributes
+        assert attributes["version"] is span_data.attributes["version"]
+        assert attributes["id"] == span_data.attributes["id"]
+        assert attributes["name"] == "test_span"
+
+    # A single span is sent unchanged
+    response = exporter.export(spans[:1])
+
+    data = json.loads(decompress_payload(response.request.body))[0]
+    assert "host" not in data["common"]["attributes"]
+    assert data["spans"][0]["attributes"]["host"] == "a"
+
+
+def trace_span(trace_id, name="test_span"):
+    context = span_context.SpanContext(trace_id=trace_id, span_id="6e0c63257de34c92")
+    return SPAN_DATA._replace(name=name, context=context)
+
+
+def test_sharded_transport_keeps_traces_together(insert_key):
+    exporter = RecordingExporter(
+        insert_key,
+        service_name="Python Application",
+        transport=functools.partial(ShardedTransport, shards=4, wait_period=3600),
+    )
+    transport = exporter._transport
+    trace_ids = ["{:032x}".format(i) for i in range(1, 17)]
+
+    for _ in range(3):
+        exporter.export([trace_span(trace_id) for trace_id in trace_ids])
+    exporter.export([trace_span(trace_ids[0], "root")._replace(parent_span_id=None)])
+
+    assert transport.counters == {
+        "priority": {"enqueued": 1, "dropped": 0, "exported": 0, "pending": 1},
+        "bulk": {"enqueued": 48, "dropped": 0, "exported": 0, "pending": 48},
+    }
+
+    exporter.stop()
+
+    for shard in transport.shards:
+        assert not shard._thread.is_alive()
+
+    # Each shard sends its pending spans in a single batch. A trace is only
+    # ever assigned to a single shard.
+    assert sum(len(batch) for batch in exporter.batches) == 49
+    sent_traces = set()
+    for batch in exporter.batches:
+        batch_traces = {span.trace_id for span in batch}
+        assert not batch_traces & sent_traces
+        sent_traces |= batch_traces
+    assert sent_traces == set(trace_ids)
+
+
+def test_sharded_transport_reuses_a_connection_per_shard():
+    with StubServer(latency=0.01) as server:
+        exporter = NewRelicTraceExporter(
+            "insert-key",
+            service_name="Python Application",
+            transport=functools.partial(ShardedTransport, shards=4, wait_period=0.01),
+        )
+        exporter.client = client = server.client(SpanClient)
+        trace_ids = ["{:032x}".format(i) for i in range(1, 17)]
+
+        for _ in range(20):
+            exporter.export([trace_span(trace_id) for trace_id in trace_ids])
+            time.sleep(0.005)
+        exporter.stop()
+
+    assert client._pool.pool.maxsize == 4
+    assert client._pool.num_connections <= 4
+
+
+def test_fanout_encodes_once(insert_key, monkeypatch):
+    payloads = []
+    create_payload = SpanClient._create_payload
+
+    def _create_payload(self, items, common):
+        payload = create_payload(self, items, common)
+        payloads.append(payload)
+        return payload
+
+    monkeypatch.setattr(SpanClient, "_create_payload", _create_payload)
+    exporter = NewRelicTraceExporter(
+        insert_key,
+        service_name="Python Application",
+        transport=Transport,
+        destinations=[
+            {"insert_key": "first", "host": "first-host"},
+            {"insert_key": "second", "host": "second-host", "port": 8443},
+        ],
+    )
+    fanout = exporter._fanout
+
+    response = exporter.export([SPAN_DATA])
+    exporter.stop()
+
+    assert len(payloads) == 1
+    assert response.request.body == payloads[0]
+    assert [d.client._pool.host for d in fanout.destinations] == [
+        "first-host",
+        "second-host",
+    ]
+    assert fanout.destinations[1].client._pool.port == 8443
+    assert fanout.counters == [
+        {"sent": 1, "failed": 0, "dropped": 0, "pending": 0},
+        {"sent": 1, "failed": 0, "dropped": 0, "pending": 0},
+    ]
+
+
+class Response(object):
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+
+@pytest.mark.parametrize(
+    "response,attempts,delay",
+    (
+        (None, 1, 1.0),
+        (Response(503), 3, 4.0),
+        (Response(503), 10, 30.0),
+        (Response(429, {"Retry-After": "120"}), 1, 120.0),
+        (Response(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}), 2, 2.0),
+        (Response(429), 1, 1.0),
+    ),
+)
+def test_fanout_retry_backoff(response, attempts, delay):
+    fanout = Fanout(SpanClient, [{"insert_key": "other"}])
+    (destination,) = fanout.destinations
+
+    assert destination._backoff(response, attempts) == delay
+
+
+def test_stopped_destination_drops_payloads_awaiting_retry():
+    with StubServer(status=503) as server:
+        fanout = Fanout(SpanClient, [{"insert_key": "other"}])
+        (destination,) = fanout.destinations
+        destination.client = server.client(SpanClient)
+
+        start = time.time()
+        fanout.publish(b"payload")
+        while not destination.counters["failed"]:
+            time.sleep(0.01)
+        fanout.stop()
+        elapsed = time.time() - start
+
+    assert elapsed < destination.retry_delay
+    assert server.requests == 1
+    assert destination.counters == {
+        "sent": 0,
+        "failed": 1,
+        "dropped": 1,
+        "pending": 0,
+    }
+
+
+def test_fanout_destinations_fail_independently():
+    primary, good, bad = StubServer(), StubServer(), StubServer(status=503)
+    for server in (primary, good, bad):
+        server.start()
+
+    exporter = NewRelicTraceExporter(
+        "insert-key",
+        service_name="Python Application",
+        transport=Transport,
+        destinations=[{"insert_key": "bad"}, {"insert_key": "good"}],
+    )
+    exporter.client = primary.client(SpanClient)
+    bad_destination, good_destination = exporter._fanout.destinations
+    bad_destination.client = bad.client(SpanClient)
+    bad_destination.retry_delay = 0.05
+    good_destination.client = good.client(SpanClient)
+
+    start = time.time()
+    response = exporter.export([SPAN_DATA])
+    while not bad_destination.counters["dropped"] and time.time() - start < 5:
+        time.sleep(0.01)
+    elapsed = time.time() - start
+    exporter.stop()
+
+    for server in (primary, good, bad):
+        server.stop()
+
+    # Retries back off exponentially
+    assert elapsed >= 0.05 + 0.1 + 0.2
+    assert response.status == 202
+    assert (primary.requests, good.requests) == (1, 1)
+    assert bad.requests == bad_destination.max_retries + 1
+    assert good_destination.counters["sent"] == 1
+    assert bad_destination.counters == {
+        "sent": 0,
+        "failed": bad_destination.max_retries + 1,
+        "dropped": 1,
+        "pending": 0,
+    }